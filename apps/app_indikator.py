@@ -1,23 +1,15 @@
+import functools
 import os
 
-import pandas as pd
-import plotly.express as px
 import streamlit as st
 from dotenv import load_dotenv
 
-from components import SiteIndicator
-from load import load_indicator
-from load import load_indicators
-from load import load_municipalities
-from utils import get_topic_lvl
+import metrics
 
 load_dotenv()
 
 st.set_page_config(page_title='ODAPI Explorer: Indikator', layout="wide")
-
-indicators = load_indicators()
-municipalities = load_municipalities()
-
+metrics.start_rerun()
 
 # APP ########################################################################
 st.title('ODAPI Explorer: Indikator')
@@ -41,6 +33,22 @@ st.warning(
 """
 )
 
+# The data modules (pandas, pyarrow, plotly) and the data itself are loaded
+# after the page shell has been sent, so that the page is shown right away.
+with st.spinner('Lade Indikatoren ...'):
+    import pandas as pd
+
+    import derived
+    import export
+    from components import SiteIndicator
+    from load import load_indicator
+    from load import load_indicator_years
+    from load import load_indicators
+    from load import load_municipalities
+    from utils import get_topic_lvl
+
+    indicators = load_indicators()
+
 tab_indicator, tab_data = st.tabs(['Indikator', 'Daten'])
 
 # VISUALS: INDIKATOR #########################################################
@@ -87,24 +95,92 @@ with tab_indicator:
                 options=df['period_ref'].unique(),
                 value=max_period_ref,
             )
+            sel_map_layer = st.radio(
+                'Kartenebene',
+                options=['Wert', 'Durchschnitt Nachbargemeinden', 'Räumliche Cluster'],
+                horizontal=True,
+            )
+            sel_client_side_years = st.toggle(
+                'Jahr von Karte und Histogramm im Browser wechseln',
+                value=True,
+                # The spatial layers are computed on the server for one year.
+                disabled=sel_map_layer != 'Wert',
+                help=(
+                    'Alle Jahre werden einmal geladen. Karte und Histogramm zeigen zuerst '
+                    'das oben ausgewählte Jahr, der Regler in der Karte bzw. im Histogramm '
+                    'wechselt das Jahr dann ohne erneute Anfrage an den Server. Nur für die '
+                    'Kartenebene `Wert` verfügbar.'
+                ),
+            )
 
-        st.plotly_chart(SiteIndicator.fig_map_by_year(df, hist_year))
+        client_side_years = False
+        if sel_client_side_years and sel_map_layer == 'Wert':
+            client_side_years = derived.client_side_years(df)
+            if client_side_years:
+                st.caption(
+                    'Der Regler in der Karte bzw. im Histogramm wechselt nur deren Jahr. '
+                    'Top 5, Bottom 5 und der Vergleich zeigen das oben ausgewählte Jahr.'
+                )
+            else:
+                st.caption(
+                    'Für diesen Indikator sind zu viele Daten vorhanden, um das Jahr im Browser '
+                    'zu wechseln. Das Jahr wird über die Auswahl oben gewechselt.'
+                )
+
+        if sel_map_layer == 'Wert' and client_side_years:
+            st.plotly_chart(
+                derived.fig_map_all_years(df, sel_indicator_id, hist_year)
+            )
+        elif sel_map_layer == 'Wert':
+            st.plotly_chart(derived.fig_map_by_year(df, sel_indicator_id, hist_year))
+        else:
+            _, spatial_stats = derived.spatial_stats(df, sel_indicator_id, hist_year)
+            st.markdown(
+                f"Globales Moran's I: **{spatial_stats['moran_i']:.3f}** "
+                f"(p = {spatial_stats['p_value']:.3f}, Erwartungswert ohne räumliche Autokorrelation "
+                f"{spatial_stats['expected_i']:.3f}). "
+                "Positive Werte bedeuten, dass benachbarte Gemeinden ähnliche Werte aufweisen."
+            )
+            if sel_map_layer == 'Durchschnitt Nachbargemeinden':
+                st.plotly_chart(
+                    derived.fig_neighbour_average_map_by_year(
+                        df, sel_indicator_id, hist_year
+                    )
+                )
+            else:
+                st.markdown(
+                    "Cluster nach lokalem Moran's I (LISA): `Hoch-Hoch` bzw. `Tief-Tief` sind Gemeinden mit hohem "
+                    "bzw. tiefem Wert, umgeben von ähnlichen Nachbargemeinden. `Hoch-Tief` und `Tief-Hoch` sind "
+                    "räumliche Ausreisser (Signifikanzniveau 5%)."
+                )
+                st.plotly_chart(
+                    derived.fig_lisa_map_by_year(df, sel_indicator_id, hist_year)
+                )
 
         c_data = st.container()
         c_data_col_1, c_data_col_2 = st.columns(2)
 
         c_data_col_1.subheader('Top 5')
         c_data_col_1.dataframe(
-            SiteIndicator.df_leader_table_by_year(df, hist_year, ascending=False),
+            derived.df_leader_table_by_year(
+                df, sel_indicator_id, hist_year, ascending=False
+            ),
             hide_index=True,
         )
         c_data_col_2.subheader('Bottom 5')
         c_data_col_2.dataframe(
-            SiteIndicator.df_leader_table_by_year(df, hist_year, ascending=True),
+            derived.df_leader_table_by_year(
+                df, sel_indicator_id, hist_year, ascending=True
+            ),
             hide_index=True,
         )
 
-        st.plotly_chart(SiteIndicator.fig_hist_by_year(df, hist_year))
+        if client_side_years:
+            st.plotly_chart(
+                derived.fig_hist_all_years(df, sel_indicator_id, hist_year)
+            )
+        else:
+            st.plotly_chart(derived.fig_hist_by_year(df, sel_indicator_id, hist_year))
 
         st.subheader('Vergleich mit anderem Indikator')
         with st.container(border=True):
@@ -134,8 +210,14 @@ with tab_indicator:
                 'Trendlinie als `Locally Weighted Scatterplot Smoothing (LOWESS)`'
             )
             st.plotly_chart(
-                SiteIndicator.fig_compare_with_other_indicator(
-                    df_compare_sel, indicators, sel_indicator_id, sel_other_indicator_id
+                derived.fig_compare_with_other_indicator(
+                    df_compare_sel,
+                    df,
+                    df_other,
+                    indicators,
+                    sel_indicator_id,
+                    sel_other_indicator_id,
+                    hist_year,
                 )
             )
 
@@ -156,8 +238,8 @@ with tab_indicator:
             "Leere Flächen deuten oft darauf hin, dass eine Gemeinde fusiniert wurde und deshalb nicht dargstellt werden kann. "
         )
         st.plotly_chart(
-            SiteIndicator.fig_change_over_time(
-                df, sel_year_range_lower, sel_year_range_upper
+            derived.fig_change_over_time(
+                df, sel_indicator_id, sel_year_range_lower, sel_year_range_upper
             )
         )
 
@@ -166,8 +248,8 @@ with tab_indicator:
             "Zeigt einen Boxplot (inklusive Outlier) über die verschiedenen Jahre an. "
         )
         st.plotly_chart(
-            SiteIndicator.fig_boxplot_per_year(
-                df, sel_year_range_lower, sel_year_range_upper
+            derived.fig_boxplot_per_year(
+                df, sel_indicator_id, sel_year_range_lower, sel_year_range_upper
             )
         )
 
@@ -175,8 +257,8 @@ with tab_indicator:
             "Zeigt eine Heatmap der Verteilung der Werte über die verschiedenen Jahre an. "
         )
         st.plotly_chart(
-            SiteIndicator.fig_heatmap_per_year(
-                df, sel_year_range_lower, sel_year_range_upper
+            derived.fig_heatmap_per_year(
+                df, sel_indicator_id, sel_year_range_lower, sel_year_range_upper
             )
         )
 
@@ -197,3 +279,94 @@ with tab_data:
     with st.container(border=True):
         st.subheader('Download Daten')
         st.write_stream(SiteIndicator.data_download_urls(sel_indicator_id))
+
+    with st.container(border=True):
+        st.subheader('Export mehrerer Indikatoren')
+        st.markdown(
+            "Exportiert mehrere Indikatoren zusammen in einer Tabelle. "
+            "Im Format `Lang` enthält jede Zeile einen Wert (Gemeinde, Jahr, Indikator), "
+            "im Format `Breit` gibt es pro Indikator eine Spalte. "
+            "Ohne Auswahl von Gemeinden werden alle Gemeinden exportiert."
+        )
+        sel_export_indicator_ids = st.multiselect(
+            'Auswahl Indikatoren',
+            options=[i['indicator_id'] for i in indicators],
+            default=[sel_indicator_id, sel_other_indicator_id],
+            format_func=lambda x: [
+                f"{i['indicator_name']} | {i['indicator_unit']}"
+                for i in indicators
+                if i['indicator_id'] == x
+            ][0],
+        )
+        _df_municipalities = load_municipalities().sort_values('gemeinde_name')
+        sel_export_geo_values = st.multiselect(
+            'Auswahl Gemeinden',
+            options=_df_municipalities['gemeinde_bfs_id'].tolist(),
+            format_func=dict(
+                zip(
+                    _df_municipalities['gemeinde_bfs_id'],
+                    _df_municipalities['gemeinde_name'],
+                )
+            ).get,
+        )
+        _export_years = sorted(
+            {
+                year
+                for indicator_id in sel_export_indicator_ids
+                for year in load_indicator_years(
+                    indicator_id,
+                    cached=indicator_id in (sel_indicator_id, sel_other_indicator_id),
+                )
+            }
+        ) or sorted({min_period_ref.year, max_period_ref.year})
+        if len(_export_years) > 1:
+            sel_export_year_lower, sel_export_year_upper = st.slider(
+                'Jahre',
+                min_value=_export_years[0],
+                max_value=_export_years[-1],
+                value=(_export_years[0], _export_years[-1]),
+            )
+        else:
+            sel_export_year_lower = sel_export_year_upper = _export_years[0]
+            st.caption(
+                f'Die ausgewählten Indikatoren enthalten nur das Jahr {_export_years[0]}.'
+            )
+        c_export_col_1, c_export_col_2 = st.columns(2)
+        sel_export_layout = c_export_col_1.radio(
+            'Tabellenformat',
+            options=['long', 'wide'],
+            horizontal=True,
+            format_func={'long': 'Lang', 'wide': 'Breit'}.get,
+        )
+        sel_export_format = c_export_col_2.radio(
+            'Dateiformat',
+            options=['csv', 'parquet'],
+            horizontal=True,
+            format_func={'csv': 'CSV', 'parquet': 'Parquet'}.get,
+        )
+        # The export is only built when the download is requested.
+        st.download_button(
+            'Export herunterladen',
+            data=functools.partial(
+                export.export_file,
+                indicators,
+                sel_export_indicator_ids,
+                sel_export_geo_values or None,
+                sel_export_year_lower,
+                sel_export_year_upper,
+                sel_export_layout,
+                sel_export_format,
+                cached_indicator_ids=[sel_indicator_id, sel_other_indicator_id],
+            ),
+            file_name=f'odapi_export_{sel_export_layout}.{sel_export_format}',
+            mime=export.MIME_TYPES[sel_export_format],
+            disabled=not sel_export_indicator_ids,
+            on_click='ignore',
+        )
+
+
+# PERFORMANCE ################################################################
+if metrics.SHOW_PERFORMANCE:
+    with st.expander('Performance'):
+        st.dataframe(metrics.df_current_rerun(), hide_index=True)
+metrics.finish_rerun()
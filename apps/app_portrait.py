@@ -1,18 +1,12 @@
-import pandas as pd
-import plotly.express as px
 import streamlit as st
 
-from load import load_indicators
-from load import load_municipalities
-from utils import get_topic_lvl
+import metrics
 
 ##############################################################################
 # SITE STRUCTURE #############################################################
 ##############################################################################
 st.set_page_config(layout="wide")
-
-indicators = load_indicators()
-municipalities = load_municipalities()
+metrics.start_rerun()
 
 
 st.title('ODAPI Explorer: Gemeinde-Portrait')
@@ -22,6 +16,22 @@ st.markdown(
 """
 )
 
+# The data modules (pandas, pyarrow, plotly) and the data itself are loaded
+# after the page shell has been sent, so that the page is shown right away.
+with st.spinner('Lade Gemeinden ...'):
+    import pandas as pd
+
+    from components import SitePortrait
+    from load import OdapiWrapper
+    from load import load_indicators
+    from load import load_municipalities
+    from load import load_values
+    from peers import peer_index
+    from utils import get_topic_lvl
+
+    indicators = load_indicators()
+    municipalities = load_municipalities()
+
 tab_indicator, tab_portrait, tab_benchmark = st.tabs(
     ['Indikator', 'Portrait', 'Benchmark']
 )
@@ -62,10 +72,12 @@ with tab_portrait:
             ]['gemeinde_name'].values[0],
         )
 
-    data_portrait = pd.read_parquet(
-        f'https://odapi.bardos.dev/portrait/polg/{sel_municipality_id}/parquet?join_indicator=true'
-    )
-    data_hist = pd.read_parquet(f'http://localhost:8000/values/polg/parquet')
+    with metrics.span('load_portrait') as _span:
+        data_portrait = pd.read_parquet(
+            OdapiWrapper().url_portrait_polg(sel_municipality_id, 'parquet')
+        )
+        _span.rows = len(data_portrait.index)
+    data_hist = load_values()
 
     unique_indicators = data_portrait['indicator_id'].unique().tolist()
 
@@ -83,17 +95,11 @@ with tab_portrait:
         ].values[0]
         _df = data_portrait[data_portrait['indicator_id'] == indicator_id]
         _df = _df.sort_values('period_ref')
-        _df_hist = data_hist[data_hist['indicator_id'] == indicator_id]
+        _df_hist = SitePortrait.df_hist(data_hist, indicator_id)
         _latest_value = _df['indicator_value_numeric'].values[-1]
         _latest_year = _df['period_ref'].values[-1]
         _delta_pct = _df['indicator_value_numeric'].pct_change().values[-1]
         _sources = _df['source'].unique().tolist()
-        _df_hist['rank'] = (
-            _df_hist[['indicator_id', 'indicator_value_numeric']]
-            .groupby('indicator_id')['indicator_value_numeric']
-            .rank(ascending=False)
-        )
-        print(_df_hist[_df_hist['geo_value'] == 230])
 
         if idx % 2 == 0:
             portrait_col = portrait_col1
@@ -122,43 +128,21 @@ with tab_portrait:
                 help=f"von {len(_df_hist[_df_hist['indicator_id'] == indicator_id]):.0f} Gemeinden",
             )
 
-            fig_line = px.line(
-                _df,
-                x='period_ref',
-                y='indicator_value_numeric',
-                title=_indicator_name,
-                labels={
-                    'period_ref': 'Jahr',
-                    'indicator_value_numeric': _indicator_unit,
-                },
-                height=400,
-            )
-            fig_line.update_layout(
-                yaxis_title=None, xaxis_fixedrange=True, yaxis_fixedrange=True
-            )
-            st.plotly_chart(fig_line, key=f'line_{indicator_id}')
-
-            fig_hist = px.histogram(
-                _df_hist,
-                title='Histogramm (aktuellstes Jahr)',
-                x='indicator_value_numeric',
-                nbins=50,
-                height=300,
-                labels={
-                    'count': 'Anzahl',
-                    'indicator_value_numeric': _indicator_unit,
-                },
+            st.plotly_chart(
+                SitePortrait.fig_line(_df, _indicator_name, _indicator_unit),
+                key=f'line_{indicator_id}',
             )
-            fig_hist.add_vline(
-                x=_latest_value,
-                line_dash='dash',
-                line_color='#AD49E1',
-                annotation_text=f'  {municipalities[municipalities["gemeinde_bfs_id"] == sel_municipality_id]["gemeinde_name"].values[0]}  ',
+            st.plotly_chart(
+                SitePortrait.fig_hist(
+                    _df_hist,
+                    _latest_value,
+                    _indicator_unit,
+                    municipalities[
+                        municipalities['gemeinde_bfs_id'] == sel_municipality_id
+                    ]['gemeinde_name'].values[0],
+                ),
+                key=f'hist_{indicator_id}',
             )
-            fig_hist.update_layout(
-                yaxis_title=None, xaxis_fixedrange=True, yaxis_fixedrange=True
-            )
-            st.plotly_chart(fig_hist, key=f'hist_{indicator_id}')
 
             st.markdown(
                 f"""
@@ -188,6 +172,87 @@ with tab_benchmark:
 
     st.markdown(
         """
-        Coming soon.
+        Unter `Benchmark` werden die Gemeinden gesucht, die einer bestimmten Gemeinde über alle (oder ausgewählte) Indikatoren am ähnlichsten sind.
+        Dazu werden alle Indikatoren standardisiert (z-Wert), die Distanz entspricht der euklidischen Distanz pro Indikator.
         """
     )
+    data_values = load_values()
+    _benchmark_years = sorted(data_values['period_ref'].dt.year.unique().tolist())
+
+    with st.container(border=True):
+        bench_col1, bench_col2 = st.columns([3, 1])
+        sel_benchmark_municipality_id = bench_col1.selectbox(
+            'Auswahl Gemeinde',
+            options=_municipality_options,
+            index=0,
+            format_func=lambda x: municipalities[
+                municipalities['gemeinde_bfs_id'] == x
+            ]['gemeinde_name'].values[0],
+            key='benchmark_municipality',
+        )
+        sel_benchmark_year = bench_col2.selectbox(
+            'Jahr',
+            options=_benchmark_years,
+            index=len(_benchmark_years) - 1,
+        )
+        sel_benchmark_topics = st.multiselect(
+            'Einschränkung auf Themen (leer: alle Indikatoren)',
+            options=sorted({i['topic_1'] for i in indicators if i['topic_1']}),
+        )
+        sel_benchmark_k = st.slider(
+            'Anzahl Vergleichsgemeinden', min_value=5, max_value=25, value=10
+        )
+
+    index = peer_index(data_values, sel_benchmark_year)
+    _benchmark_indicator_ids = None
+    if sel_benchmark_topics:
+        _benchmark_indicator_ids = [
+            i['indicator_id'] for i in indicators if i['topic_1'] in sel_benchmark_topics
+        ]
+    df_peers = index.peers(
+        sel_benchmark_municipality_id, sel_benchmark_k, _benchmark_indicator_ids
+    )
+
+    if len(df_peers.index) == 0:
+        st.warning("Keine Daten für die ausgewählte Gemeinde und das Jahr vorhanden.")
+    else:
+        _names = municipalities.set_index('gemeinde_bfs_id')['gemeinde_name']
+        st.subheader('Ähnlichste Gemeinden')
+        st.dataframe(
+            pd.DataFrame(
+                {
+                    'Gemeinde': _names.reindex(df_peers['geo_value']).values,
+                    'Distanz': df_peers['distance'].values,
+                }
+            ),
+            hide_index=True,
+        )
+
+        st.subheader('Profil')
+        st.markdown(
+            "Standardisierte Werte (z-Wert) der Indikatoren, bei denen die ausgewählte Gemeinde am stärksten vom Durchschnitt abweicht."
+        )
+        _df_profile = index.df_profile(
+            [sel_benchmark_municipality_id, *df_peers['geo_value'].tolist()]
+        )
+        if _benchmark_indicator_ids:
+            _df_profile = _df_profile.loc[
+                :, _df_profile.columns.isin(_benchmark_indicator_ids)
+            ]
+        _top_indicators = (
+            _df_profile.iloc[0].abs().sort_values(ascending=False).head(10).index
+        )
+        _indicator_names = {i['indicator_id']: i['indicator_name'] for i in indicators}
+        st.dataframe(
+            _df_profile[_top_indicators]
+            .T.rename(index=_indicator_names)
+            .rename(columns=_names.to_dict())
+            .round(2)
+        )
+
+
+# PERFORMANCE ################################################################
+if metrics.SHOW_PERFORMANCE:
+    with st.expander('Performance'):
+        st.dataframe(metrics.df_current_rerun(), hide_index=True)
+metrics.finish_rerun()
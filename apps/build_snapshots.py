@@ -0,0 +1,125 @@
+"""
+Build the prebuilt snapshots of the derived figures and tables of app_indikator.py.
+
+    python apps/build_snapshots.py --output /data/snapshots
+    python apps/build_snapshots.py --output /data/snapshots --indicators 12,34,56
+
+Builds the figures for the default indicator pair of app_indikator.py and the
+given (popular) indicators for all their years and writes them as gzipped
+plotly JSON. With ODAPI__SNAPSHOT_DIR set, the app serves a snapshot instead of
+building the figure, if one matches the inputs. Rebuild the snapshots after
+changing a figure, and after a data refresh, as outdated snapshots are no
+longer served.
+"""
+
+import argparse
+import logging
+import os
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+import derived
+import metrics
+import snapshots
+from components import SiteIndicator
+from load import load_indicator
+from load import load_indicators
+
+load_dotenv()
+
+# Additional indicators to snapshot, comma separated (see --indicators).
+SNAPSHOT_INDICATORS = os.getenv('ODAPI__SNAPSHOT_INDICATORS', '')
+
+# Index of the default indicator and comparison indicator in app_indikator.py.
+DEFAULT_INDICATOR_INDEXES = (125, 72)
+
+
+def build_indicator(
+    sel_indicator_id: int, sel_other_indicator_id: int | None, indicators: list
+):
+    """
+    Build the snapshots of one indicator for all its years. The comparison
+    figure is only built for the given other indicator.
+    """
+    df = load_indicator(sel_indicator_id)
+    periods = sorted(df['period_ref'].unique())
+    for year in periods:
+        derived.fig_map_by_year(df, sel_indicator_id, year)
+        derived.fig_hist_by_year(df, sel_indicator_id, year)
+        for ascending in [False, True]:
+            derived.df_leader_table_by_year(df, sel_indicator_id, year, ascending)
+    if derived.client_side_years(df):
+        derived.fig_map_all_years(df, sel_indicator_id, periods[-1])
+        derived.fig_hist_all_years(df, sel_indicator_id, periods[-1])
+    derived.fig_change_over_time(df, sel_indicator_id, periods[0], periods[-1])
+    derived.fig_boxplot_per_year(df, sel_indicator_id, periods[0], periods[-1])
+    derived.fig_heatmap_per_year(df, sel_indicator_id, periods[0], periods[-1])
+
+    if sel_other_indicator_id is None:
+        return
+    df_other = load_indicator(sel_other_indicator_id)
+    for year in periods:
+        df_compare = SiteIndicator.df_other(
+            df[df['period_ref'] == year], df_other, year
+        )
+        if len(df_compare.index) == 0:
+            continue
+        derived.fig_compare_with_other_indicator(
+            df_compare,
+            df,
+            df_other,
+            indicators,
+            sel_indicator_id,
+            sel_other_indicator_id,
+            year,
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--output',
+        default=snapshots.SNAPSHOT_DIR,
+        help='Default: ODAPI__SNAPSHOT_DIR',
+    )
+    parser.add_argument(
+        '--indicators',
+        default=SNAPSHOT_INDICATORS,
+        help='Comma separated indicator ids. Default: ODAPI__SNAPSHOT_INDICATORS',
+    )
+    args = parser.parse_args()
+    if not args.output:
+        parser.error('No output directory given.')
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+
+    indicators = load_indicators()
+    sel_indicator_id, sel_other_indicator_id = (
+        indicators[i]['indicator_id'] for i in DEFAULT_INDICATOR_INDEXES
+    )
+    indicator_ids = [sel_indicator_id, sel_other_indicator_id] + [
+        int(i) for i in args.indicators.split(',') if i.strip()
+    ]
+    with snapshots.recording(args.output):
+        for indicator_id in dict.fromkeys(indicator_ids):
+            # Remove the snapshots of the previous build, they would never
+            # match again after a data refresh.
+            for path in (Path(args.output) / str(indicator_id)).glob('*.json.gz'):
+                path.unlink()
+            with metrics.span('snapshot_build') as _span:
+                build_indicator(
+                    indicator_id,
+                    (
+                        sel_other_indicator_id
+                        if indicator_id == sel_indicator_id
+                        else None
+                    ),
+                    indicators,
+                )
+            print(f'Indicator {indicator_id}: {_span.duration:.1f} s')
+
+
+if __name__ == '__main__':
+    main()
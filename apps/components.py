@@ -2,6 +2,7 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 
+import metrics
 from load import OdapiWrapper
 from utils import decide_colorscale
 from utils import decide_range_color
@@ -57,6 +58,7 @@ class SiteIndicator(BaseSite):
         yield f"* als GeoParquet-File: {_url_parquet}"
 
     @classmethod
+    @metrics.timed('SiteIndicator.df_leader_table_by_year')
     def df_leader_table_by_year(
         cls, df: pd.DataFrame, period_ref: str, ascending: bool = True
     ) -> pd.DataFrame:
@@ -70,6 +72,7 @@ class SiteIndicator(BaseSite):
         ]
 
     @classmethod
+    @metrics.timed('SiteIndicator.df_other')
     def df_other(
         cls, df: pd.DataFrame, df_other: pd.DataFrame, hist_year: str
     ) -> pd.DataFrame:
@@ -86,6 +89,7 @@ class SiteIndicator(BaseSite):
         return df
 
     @classmethod
+    @metrics.timed('SiteIndicator.fig_map_by_year')
     def fig_map_by_year(cls, df: pd.DataFrame, year: int) -> go.Figure:
         _df = df[df['period_ref'] == year]
         _fig_map = px.choropleth_mapbox(
@@ -129,6 +133,101 @@ class SiteIndicator(BaseSite):
         return _fig_map
 
     @classmethod
+    def _year_slider(cls, periods: list, **kwargs) -> dict:
+        """
+        Slider switching between the animation frames of the given periods in
+        the browser. The last period is active, see select_year.
+        """
+        labels = [pd.Timestamp(p).strftime('%Y') for p in periods]
+        if len(set(labels)) < len(labels):
+            labels = [pd.Timestamp(p).strftime('%Y-%m-%d') for p in periods]
+        return dict(
+            active=len(periods) - 1,
+            currentvalue=dict(prefix='Jahr: '),
+            steps=[
+                dict(
+                    method='animate',
+                    label=label,
+                    args=[
+                        [str(p)],
+                        dict(
+                            mode='immediate',
+                            frame=dict(duration=0, redraw=True),
+                            transition=dict(duration=0),
+                        ),
+                    ],
+                )
+                for p, label in zip(periods, labels)
+            ],
+            **kwargs,
+        )
+
+    @classmethod
+    @metrics.timed('SiteIndicator.fig_map_all_years')
+    def fig_map_all_years(cls, df: pd.DataFrame) -> go.Figure:
+        """
+        Map of all years, switched by a slider in the browser. The borders are
+        sent once (latest border per municipality), every year only adds an
+        animation frame with its values and color range.
+        """
+        periods = sorted(df['period_ref'].unique())
+        _df_base = (
+            df.sort_values('period_ref')
+            .drop_duplicates('geo_value', keep='last')
+            .reset_index(drop=True)
+        )
+        _df_base['period_ref'] = periods[-1]
+        _values = (
+            df.drop_duplicates(['period_ref', 'geo_value'])
+            .pivot(
+                index='geo_value',
+                columns='period_ref',
+                values='indicator_value_numeric',
+            )
+            .reindex(_df_base['geo_value'])
+        )
+        _fig_map = cls.fig_map_by_year(_df_base, periods[-1])
+
+        frames = {}
+        for period in periods:
+            _df_year = df[df['period_ref'] == period]
+            cmin, cmax = decide_range_color(_df_year)
+            frames[str(period)] = go.Frame(
+                name=str(period),
+                data=[
+                    dict(
+                        type='choroplethmapbox',
+                        z=_values[period].to_numpy(),
+                    )
+                ],
+                traces=[0],
+                layout=dict(
+                    coloraxis=dict(
+                        cmin=cmin,
+                        cmax=cmax,
+                        colorscale=decide_colorscale(_df_year),
+                    )
+                ),
+            )
+        _fig_map.update(frames=list(frames.values()))
+        _fig_map.update_traces(z=frames[str(periods[-1])].data[0].z)
+        _fig_map.update_layout(
+            frames[str(periods[-1])].layout,
+            sliders=[
+                cls._year_slider(
+                    periods,
+                    x=0.02,
+                    len=0.55,
+                    y=0.02,
+                    yanchor='bottom',
+                    pad=dict(t=0),
+                )
+            ],
+        )
+        return _fig_map
+
+    @classmethod
+    @metrics.timed('SiteIndicator.fig_boxplot_per_year')
     def fig_boxplot_per_year(
         cls, df: pd.DataFrame, lower_period_ref: str, upper_period_ref: str
     ) -> go.Figure:
@@ -161,6 +260,7 @@ class SiteIndicator(BaseSite):
         return fig
 
     @classmethod
+    @metrics.timed('SiteIndicator.fig_heatmap_per_year')
     def fig_heatmap_per_year(
         cls, df: pd.DataFrame, lower_period_ref: str, upper_period_ref: str
     ) -> go.Figure:
@@ -184,6 +284,7 @@ class SiteIndicator(BaseSite):
         return fig
 
     @classmethod
+    @metrics.timed('SiteIndicator.fig_compare_with_other_indicator')
     def fig_compare_with_other_indicator(
         cls,
         df: pd.DataFrame,
@@ -229,6 +330,7 @@ class SiteIndicator(BaseSite):
         return fig
 
     @classmethod
+    @metrics.timed('SiteIndicator.fig_hist_by_year')
     def fig_hist_by_year(cls, df: pd.DataFrame, year: int) -> go.Figure:
         fig = px.histogram(
             df[df['period_ref'] == year],
@@ -241,6 +343,66 @@ class SiteIndicator(BaseSite):
         return fig
 
     @classmethod
+    @metrics.timed('SiteIndicator.fig_hist_all_years')
+    def fig_hist_all_years(cls, df: pd.DataFrame) -> go.Figure:
+        """
+        Histogram of all years, switched by a slider in the browser.
+        """
+        periods = sorted(df['period_ref'].unique())
+        fig = cls.fig_hist_by_year(df, periods[-1])
+        fig.update(
+            frames=[
+                go.Frame(
+                    name=str(period),
+                    data=[
+                        dict(
+                            type='histogram',
+                            x=df.loc[
+                                df['period_ref'] == period, 'indicator_value_numeric'
+                            ].to_numpy(),
+                        )
+                    ],
+                    traces=[0],
+                    layout=dict(
+                        xaxis=dict(autorange=True), yaxis=dict(autorange=True)
+                    ),
+                )
+                for period in periods
+            ]
+        )
+        fig.update_layout(
+            height=400,
+            sliders=[cls._year_slider(periods, pad=dict(t=50))],
+        )
+        return fig
+
+    @classmethod
+    def select_year(cls, fig: dict, year) -> dict:
+        """
+        Show the given year first in a figure dict of fig_map_all_years or
+        fig_hist_all_years: the values and layout of its frame and the active
+        slider step. Only the changed parts are copied, the frames and the
+        borders are shared with the given figure.
+        """
+        frame = next(f for f in fig['frames'] if f['name'] == str(year))
+        trace = {**fig['data'][0], **frame['data'][0]}
+        layout = {
+            **fig['layout'],
+            **{
+                key: {**fig['layout'].get(key, {}), **value}
+                for key, value in frame['layout'].items()
+            },
+        }
+        slider = fig['layout']['sliders'][0]
+        steps = [step['args'][0][0] for step in slider['steps']]
+        layout['sliders'] = [
+            {**slider, 'active': steps.index(str(year))},
+            *fig['layout']['sliders'][1:],
+        ]
+        return {**fig, 'data': [trace, *fig['data'][1:]], 'layout': layout}
+
+    @classmethod
+    @metrics.timed('SiteIndicator.fig_change_over_time')
     def fig_change_over_time(
         cls, df: pd.DataFrame, lower_period_ref: str, upper_period_ref: str
     ) -> go.Figure:
@@ -293,3 +455,181 @@ class SiteIndicator(BaseSite):
             coloraxis_colorbar_len=0.35,
         )
         return _fig_map
+
+    @classmethod
+    @metrics.timed('SiteIndicator.fig_neighbour_average_map_by_year')
+    def fig_neighbour_average_map_by_year(
+        cls, df: pd.DataFrame, df_stats: pd.DataFrame, year: int
+    ) -> go.Figure:
+        _col_name = 'neighbour_average'
+        _df = df[df['period_ref'] == year].merge(df_stats, on='geo_value')
+        _fig_map = px.choropleth_mapbox(
+            _df,
+            geojson=_df.geometry,
+            locations=_df.index,
+            color=_col_name,
+            mapbox_style='carto-positron',
+            opacity=0.5,
+            zoom=7.4,
+            center=dict(lat=46.8, lon=8.4),
+            color_continuous_scale=decide_colorscale(_df, _col_name),
+            range_color=decide_range_color(_df, _col_name),
+            hover_data={
+                'geo_name': True,
+                'bezirk_name': True,
+                'kanton_name': True,
+                'indicator_unit': True,
+                'indicator_value_numeric': True,
+            },
+            labels={_col_name: _df['indicator_unit'].iloc[0][:30]},
+        )
+        _fig_map.update_traces(
+            hovertemplate=(
+                'Gemeinde <b>%{customdata[0]}</b><br>'
+                'Durchschnitt Nachbargemeinden <b>%{z:.2f}</b> %{customdata[3]}<br>'
+                'Wert Gemeinde <b>%{customdata[4]}</b> %{customdata[3]}<br><br>'
+                'Bezirk %{customdata[1]} <br>'
+                'Kanton %{customdata[2]} <br>'
+            ),
+        )
+        _fig_map.update_layout(
+            geo=dict(fitbounds="locations", visible=False),
+            margin=dict(l=0, r=0, b=0, t=0, pad=4),
+            height=700,
+            coloraxis_colorbar_orientation='h',
+            coloraxis_colorbar_yanchor='bottom',
+            coloraxis_colorbar_y=0,
+            coloraxis_colorbar_xanchor='right',
+            coloraxis_colorbar_x=0.98,
+            coloraxis_colorbar_len=0.35,
+        )
+        return _fig_map
+
+    @classmethod
+    @metrics.timed('SiteIndicator.fig_lisa_map_by_year')
+    def fig_lisa_map_by_year(
+        cls, df: pd.DataFrame, df_stats: pd.DataFrame, year: int
+    ) -> go.Figure:
+        _df = df[df['period_ref'] == year].merge(df_stats, on='geo_value')
+        _fig_map = px.choropleth_mapbox(
+            _df,
+            geojson=_df.geometry,
+            locations=_df.index,
+            color='lisa_cluster',
+            mapbox_style='carto-positron',
+            opacity=0.5,
+            zoom=7.4,
+            center=dict(lat=46.8, lon=8.4),
+            color_discrete_map={
+                'Hoch-Hoch': '#D7191C',
+                'Tief-Tief': '#2C7BB6',
+                'Hoch-Tief': '#FDAE61',
+                'Tief-Hoch': '#ABD9E9',
+                'nicht signifikant': '#E5E5E5',
+            },
+            category_orders={
+                'lisa_cluster': [
+                    'Hoch-Hoch',
+                    'Tief-Tief',
+                    'Hoch-Tief',
+                    'Tief-Hoch',
+                    'nicht signifikant',
+                ]
+            },
+            hover_data={
+                'geo_name': True,
+                'bezirk_name': True,
+                'kanton_name': True,
+                'indicator_unit': True,
+                'indicator_value_numeric': True,
+                'local_moran': ':.3f',
+                'local_p_value': ':.3f',
+            },
+            labels={'lisa_cluster': 'Cluster'},
+        )
+        _fig_map.update_traces(
+            hovertemplate=(
+                'Gemeinde <b>%{customdata[0]}</b><br>'
+                'Wert <b>%{customdata[4]}</b> %{customdata[3]}<br>'
+                "Lokales Moran's I <b>%{customdata[5]:.3f}</b> "
+                '(p = %{customdata[6]:.3f})<br><br>'
+                'Bezirk %{customdata[1]} <br>'
+                'Kanton %{customdata[2]} <br>'
+            ),
+        )
+        _fig_map.update_layout(
+            geo=dict(fitbounds="locations", visible=False),
+            margin=dict(l=0, r=0, b=0, t=0, pad=4),
+            height=700,
+            legend=dict(
+                orientation='h', yanchor='bottom', y=0, xanchor='right', x=0.98
+            ),
+        )
+        return _fig_map
+
+
+class SitePortrait(BaseSite):
+
+    @classmethod
+    @metrics.timed('SitePortrait.df_hist')
+    def df_hist(cls, data_hist: pd.DataFrame, indicator_id: int) -> pd.DataFrame:
+        """
+        Get the latest values of all municipalities for the given indicator,
+        ranked from the highest value.
+        """
+        _df_hist = data_hist[data_hist['indicator_id'] == indicator_id]
+        return _df_hist.assign(
+            rank=_df_hist['indicator_value_numeric'].rank(ascending=False)
+        )
+
+    @classmethod
+    @metrics.timed('SitePortrait.fig_line')
+    def fig_line(
+        cls, df: pd.DataFrame, indicator_name: str, indicator_unit: str
+    ) -> go.Figure:
+        fig = px.line(
+            df,
+            x='period_ref',
+            y='indicator_value_numeric',
+            title=indicator_name,
+            labels={
+                'period_ref': 'Jahr',
+                'indicator_value_numeric': indicator_unit,
+            },
+            height=400,
+        )
+        fig.update_layout(
+            yaxis_title=None, xaxis_fixedrange=True, yaxis_fixedrange=True
+        )
+        return fig
+
+    @classmethod
+    @metrics.timed('SitePortrait.fig_hist')
+    def fig_hist(
+        cls,
+        df_hist: pd.DataFrame,
+        latest_value: float,
+        indicator_unit: str,
+        municipality_name: str,
+    ) -> go.Figure:
+        fig = px.histogram(
+            df_hist,
+            title='Histogramm (aktuellstes Jahr)',
+            x='indicator_value_numeric',
+            nbins=50,
+            height=300,
+            labels={
+                'count': 'Anzahl',
+                'indicator_value_numeric': indicator_unit,
+            },
+        )
+        fig.add_vline(
+            x=latest_value,
+            line_dash='dash',
+            line_color='#AD49E1',
+            annotation_text=f'  {municipality_name}  ',
+        )
+        fig.update_layout(
+            yaxis_title=None, xaxis_fixedrange=True, yaxis_fixedrange=True
+        )
+        return fig
@@ -0,0 +1,453 @@
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+import streamlit as st
+
+import metrics
+import snapshots
+from components import SiteIndicator
+from load import has_period_fingerprints
+from load import period_fingerprint
+
+# Derived results are keyed by content fingerprints, so they stay valid across
+# data refreshes as long as their periods are unchanged. The same keys are used
+# for the prebuilt snapshots (see snapshots.py). Results of periods without
+# fingerprint are neither cached nor snapshotted. The TTL and the entry limits
+# bound the memory of the caches per process: maps contain the borders of all
+# municipalities (a few MB each), the other results are small.
+DERIVED_CACHE_TTL = 60 * 60  # 1 hour
+DERIVED_CACHE_MAX_ENTRIES = 64
+DERIVED_MAP_CACHE_MAX_ENTRIES = 8
+
+# Limits for switching the year of the map and histogram in the browser (all
+# years sent at once as animation frames). Indicators above the limits fall
+# back to switching the year on the server.
+CLIENT_SIDE_MAX_YEARS = 30
+CLIENT_SIDE_PAYLOAD_BUDGET = 8 * 1024 * 1024
+
+# Approximate size of one number in the plotly JSON (full float precision and
+# separators).
+_JSON_BYTES_PER_NUMBER = 22
+
+
+def _periods_between(
+    df: pd.DataFrame, lower_period_ref: str, upper_period_ref: str
+) -> list:
+    return [
+        p
+        for p in df['period_ref'].unique()
+        if lower_period_ref <= p <= upper_period_ref
+    ]
+
+
+@metrics.timed('derived.fig_map_by_year', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL,
+    max_entries=DERIVED_MAP_CACHE_MAX_ENTRIES,
+    show_spinner=False,
+)
+def _fig_map_by_year(
+    _df: pd.DataFrame, sel_indicator_id: int, year, fingerprint: str
+) -> go.Figure | dict:
+    return snapshots.load_or_build(
+        'fig_map_by_year',
+        sel_indicator_id,
+        fingerprint,
+        lambda: SiteIndicator.fig_map_by_year(_df, year),
+    )
+
+
+def fig_map_by_year(
+    df: pd.DataFrame, sel_indicator_id: int, year
+) -> go.Figure | dict:
+    if not has_period_fingerprints(df, year):
+        return SiteIndicator.fig_map_by_year(df, year)
+    return _fig_map_by_year(
+        df, sel_indicator_id, year, period_fingerprint(df, year)
+    )
+
+
+@metrics.timed('derived.fig_hist_by_year', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL, max_entries=DERIVED_CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _fig_hist_by_year(
+    _df: pd.DataFrame, sel_indicator_id: int, year, fingerprint: str
+) -> go.Figure | dict:
+    return snapshots.load_or_build(
+        'fig_hist_by_year',
+        sel_indicator_id,
+        fingerprint,
+        lambda: SiteIndicator.fig_hist_by_year(_df, year),
+    )
+
+
+def fig_hist_by_year(
+    df: pd.DataFrame, sel_indicator_id: int, year
+) -> go.Figure | dict:
+    if not has_period_fingerprints(df, year):
+        return SiteIndicator.fig_hist_by_year(df, year)
+    return _fig_hist_by_year(
+        df, sel_indicator_id, year, period_fingerprint(df, year)
+    )
+
+
+@metrics.timed('derived.df_leader_table_by_year', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL, max_entries=DERIVED_CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _df_leader_table_by_year(
+    _df: pd.DataFrame,
+    sel_indicator_id: int,
+    year,
+    ascending: bool,
+    fingerprint: str,
+) -> pd.DataFrame:
+    return snapshots.load_or_build(
+        'df_leader_table_by_year',
+        sel_indicator_id,
+        f'{fingerprint}/{ascending}',
+        lambda: SiteIndicator.df_leader_table_by_year(_df, year, ascending),
+    )
+
+
+def df_leader_table_by_year(
+    df: pd.DataFrame, sel_indicator_id: int, year, ascending: bool = True
+) -> pd.DataFrame:
+    if not has_period_fingerprints(df, year):
+        return SiteIndicator.df_leader_table_by_year(df, year, ascending)
+    return _df_leader_table_by_year(
+        df, sel_indicator_id, year, ascending, period_fingerprint(df, year)
+    )
+
+
+def client_side_payload_bytes(df: pd.DataFrame) -> int:
+    """
+    Estimate the size of the map and histogram of all years: the borders of
+    every municipality once plus one value per municipality and year for each
+    of both figures.
+    """
+    import shapely
+
+    geometries = df.drop_duplicates('geo_value', keep='last').geometry.values
+    coordinates = int(shapely.get_num_coordinates(np.asarray(geometries)).sum())
+    return _JSON_BYTES_PER_NUMBER * (2 * coordinates + 2 * len(df.index))
+
+
+def client_side_years(df: pd.DataFrame) -> bool:
+    """
+    Decide whether the year of the map and histogram can be switched in the
+    browser, within CLIENT_SIDE_MAX_YEARS and CLIENT_SIDE_PAYLOAD_BUDGET.
+    """
+    if df['period_ref'].nunique() > CLIENT_SIDE_MAX_YEARS:
+        return False
+    return client_side_payload_bytes(df) <= CLIENT_SIDE_PAYLOAD_BUDGET
+
+
+@metrics.timed('derived.fig_map_all_years', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL,
+    max_entries=DERIVED_MAP_CACHE_MAX_ENTRIES,
+    show_spinner=False,
+)
+def _fig_map_all_years(
+    _df: pd.DataFrame, sel_indicator_id: int, fingerprint: str
+) -> dict:
+    return snapshots.load_or_build(
+        'fig_map_all_years',
+        sel_indicator_id,
+        fingerprint,
+        lambda: SiteIndicator.fig_map_all_years(_df).to_dict(),
+    )
+
+
+def fig_map_all_years(df: pd.DataFrame, sel_indicator_id: int, year) -> dict:
+    """
+    The figure of all years is built and cached once, the given year is only
+    applied to a copy.
+    """
+    periods = df['period_ref'].unique()
+    if has_period_fingerprints(df, *periods):
+        fig = _fig_map_all_years(
+            df, sel_indicator_id, period_fingerprint(df, *periods)
+        )
+    else:
+        fig = SiteIndicator.fig_map_all_years(df).to_dict()
+    return SiteIndicator.select_year(fig, year)
+
+
+@metrics.timed('derived.fig_hist_all_years', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL, max_entries=DERIVED_CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _fig_hist_all_years(
+    _df: pd.DataFrame, sel_indicator_id: int, fingerprint: str
+) -> dict:
+    return snapshots.load_or_build(
+        'fig_hist_all_years',
+        sel_indicator_id,
+        fingerprint,
+        lambda: SiteIndicator.fig_hist_all_years(_df).to_dict(),
+    )
+
+
+def fig_hist_all_years(df: pd.DataFrame, sel_indicator_id: int, year) -> dict:
+    """
+    The figure of all years is built and cached once, the given year is only
+    applied to a copy.
+    """
+    periods = df['period_ref'].unique()
+    if has_period_fingerprints(df, *periods):
+        fig = _fig_hist_all_years(
+            df, sel_indicator_id, period_fingerprint(df, *periods)
+        )
+    else:
+        fig = SiteIndicator.fig_hist_all_years(df).to_dict()
+    return SiteIndicator.select_year(fig, year)
+
+
+@metrics.timed('derived.fig_compare_with_other_indicator', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL, max_entries=DERIVED_CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _fig_compare_with_other_indicator(
+    _df: pd.DataFrame,
+    indicators: dict,
+    sel_indicator_id: int,
+    sel_other_indicator_id: int,
+    fingerprint: str,
+) -> go.Figure | dict:
+    return snapshots.load_or_build(
+        'fig_compare_with_other_indicator',
+        sel_indicator_id,
+        f'{sel_other_indicator_id}/{fingerprint}',
+        lambda: SiteIndicator.fig_compare_with_other_indicator(
+            _df, indicators, sel_indicator_id, sel_other_indicator_id
+        ),
+    )
+
+
+def fig_compare_with_other_indicator(
+    df_compare: pd.DataFrame,
+    df: pd.DataFrame,
+    df_other: pd.DataFrame,
+    indicators: dict,
+    sel_indicator_id: int,
+    sel_other_indicator_id: int,
+    year,
+) -> go.Figure | dict:
+    """
+    Get the comparison scatter plot for the merged DataFrame (see SiteIndicator.df_other).
+    Cached by the fingerprints of the selected year of both source indicators.
+    """
+    if not (
+        has_period_fingerprints(df, year) and has_period_fingerprints(df_other, year)
+    ):
+        return SiteIndicator.fig_compare_with_other_indicator(
+            df_compare, indicators, sel_indicator_id, sel_other_indicator_id
+        )
+    fingerprint = (
+        f'{period_fingerprint(df, year)}/{period_fingerprint(df_other, year)}'
+    )
+    return _fig_compare_with_other_indicator(
+        df_compare, indicators, sel_indicator_id, sel_other_indicator_id, fingerprint
+    )
+
+
+@metrics.timed('derived.fig_change_over_time', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL,
+    max_entries=DERIVED_MAP_CACHE_MAX_ENTRIES,
+    show_spinner=False,
+)
+def _fig_change_over_time(
+    _df: pd.DataFrame,
+    sel_indicator_id: int,
+    lower_period_ref: str,
+    upper_period_ref: str,
+    fingerprint: str,
+) -> go.Figure | dict:
+    return snapshots.load_or_build(
+        'fig_change_over_time',
+        sel_indicator_id,
+        fingerprint,
+        lambda: SiteIndicator.fig_change_over_time(
+            _df, lower_period_ref, upper_period_ref
+        ),
+    )
+
+
+def fig_change_over_time(
+    df: pd.DataFrame,
+    sel_indicator_id: int,
+    lower_period_ref: str,
+    upper_period_ref: str,
+) -> go.Figure | dict:
+    if not has_period_fingerprints(df, lower_period_ref, upper_period_ref):
+        return SiteIndicator.fig_change_over_time(
+            df, lower_period_ref, upper_period_ref
+        )
+    return _fig_change_over_time(
+        df,
+        sel_indicator_id,
+        lower_period_ref,
+        upper_period_ref,
+        period_fingerprint(df, lower_period_ref, upper_period_ref),
+    )
+
+
+@metrics.timed('derived.fig_boxplot_per_year', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL, max_entries=DERIVED_CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _fig_boxplot_per_year(
+    _df: pd.DataFrame,
+    sel_indicator_id: int,
+    lower_period_ref: str,
+    upper_period_ref: str,
+    fingerprint: str,
+) -> go.Figure | dict:
+    return snapshots.load_or_build(
+        'fig_boxplot_per_year',
+        sel_indicator_id,
+        fingerprint,
+        lambda: SiteIndicator.fig_boxplot_per_year(
+            _df, lower_period_ref, upper_period_ref
+        ),
+    )
+
+
+def fig_boxplot_per_year(
+    df: pd.DataFrame,
+    sel_indicator_id: int,
+    lower_period_ref: str,
+    upper_period_ref: str,
+) -> go.Figure | dict:
+    periods = _periods_between(df, lower_period_ref, upper_period_ref)
+    if not has_period_fingerprints(df, *periods):
+        return SiteIndicator.fig_boxplot_per_year(
+            df, lower_period_ref, upper_period_ref
+        )
+    return _fig_boxplot_per_year(
+        df,
+        sel_indicator_id,
+        lower_period_ref,
+        upper_period_ref,
+        period_fingerprint(df, *periods),
+    )
+
+
+@metrics.timed('derived.fig_heatmap_per_year', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL, max_entries=DERIVED_CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _fig_heatmap_per_year(
+    _df: pd.DataFrame,
+    sel_indicator_id: int,
+    lower_period_ref: str,
+    upper_period_ref: str,
+    fingerprint: str,
+) -> go.Figure | dict:
+    return snapshots.load_or_build(
+        'fig_heatmap_per_year',
+        sel_indicator_id,
+        fingerprint,
+        lambda: SiteIndicator.fig_heatmap_per_year(
+            _df, lower_period_ref, upper_period_ref
+        ),
+    )
+
+
+def fig_heatmap_per_year(
+    df: pd.DataFrame,
+    sel_indicator_id: int,
+    lower_period_ref: str,
+    upper_period_ref: str,
+) -> go.Figure | dict:
+    periods = _periods_between(df, lower_period_ref, upper_period_ref)
+    if not has_period_fingerprints(df, *periods):
+        return SiteIndicator.fig_heatmap_per_year(
+            df, lower_period_ref, upper_period_ref
+        )
+    return _fig_heatmap_per_year(
+        df,
+        sel_indicator_id,
+        lower_period_ref,
+        upper_period_ref,
+        period_fingerprint(df, *periods),
+    )
+
+
+@metrics.timed('derived.spatial_stats', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL, max_entries=DERIVED_CACHE_MAX_ENTRIES, show_spinner=False
+)
+def _spatial_stats(
+    _df: pd.DataFrame, sel_indicator_id: int, year, fingerprint: str
+) -> tuple[pd.DataFrame, dict]:
+    return _build_spatial_stats(_df, year)
+
+
+def _build_spatial_stats(df: pd.DataFrame, year) -> tuple[pd.DataFrame, dict]:
+    # Imported here, as shapely and scipy are only needed for the spatial layers.
+    import spatial
+
+    return spatial.spatial_stats(df[df['period_ref'] == year])
+
+
+def spatial_stats(
+    df: pd.DataFrame, sel_indicator_id: int, year
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Get the neighbour averages, local and global Moran's I of the given year
+    (see spatial.spatial_stats).
+    """
+    if not has_period_fingerprints(df, year):
+        return _build_spatial_stats(df, year)
+    return _spatial_stats(df, sel_indicator_id, year, period_fingerprint(df, year))
+
+
+@metrics.timed('derived.fig_neighbour_average_map_by_year', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL,
+    max_entries=DERIVED_MAP_CACHE_MAX_ENTRIES,
+    show_spinner=False,
+)
+def _fig_neighbour_average_map_by_year(
+    _df: pd.DataFrame, sel_indicator_id: int, year, fingerprint: str
+) -> go.Figure:
+    df_stats, _ = spatial_stats(_df, sel_indicator_id, year)
+    return SiteIndicator.fig_neighbour_average_map_by_year(_df, df_stats, year)
+
+
+def fig_neighbour_average_map_by_year(
+    df: pd.DataFrame, sel_indicator_id: int, year
+) -> go.Figure:
+    if not has_period_fingerprints(df, year):
+        df_stats, _ = spatial_stats(df, sel_indicator_id, year)
+        return SiteIndicator.fig_neighbour_average_map_by_year(df, df_stats, year)
+    return _fig_neighbour_average_map_by_year(
+        df, sel_indicator_id, year, period_fingerprint(df, year)
+    )
+
+
+@metrics.timed('derived.fig_lisa_map_by_year', cached=True)
+@st.cache_data(
+    ttl=DERIVED_CACHE_TTL,
+    max_entries=DERIVED_MAP_CACHE_MAX_ENTRIES,
+    show_spinner=False,
+)
+def _fig_lisa_map_by_year(
+    _df: pd.DataFrame, sel_indicator_id: int, year, fingerprint: str
+) -> go.Figure:
+    df_stats, _ = spatial_stats(_df, sel_indicator_id, year)
+    return SiteIndicator.fig_lisa_map_by_year(_df, df_stats, year)
+
+
+def fig_lisa_map_by_year(df: pd.DataFrame, sel_indicator_id: int, year) -> go.Figure:
+    if not has_period_fingerprints(df, year):
+        df_stats, _ = spatial_stats(df, sel_indicator_id, year)
+        return SiteIndicator.fig_lisa_map_by_year(df, df_stats, year)
+    return _fig_lisa_map_by_year(
+        df, sel_indicator_id, year, period_fingerprint(df, year)
+    )
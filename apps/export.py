@@ -0,0 +1,256 @@
+import io
+from typing import Iterable
+from typing import Iterator
+from typing import Literal
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+
+import metrics
+from load import load_indicator_table
+
+GEO_COLUMNS = ['geo_value', 'geo_name', 'bezirk_name', 'kanton_name', 'period_ref']
+
+LONG_SCHEMA = pa.schema(
+    [
+        ('geo_value', pa.int64()),
+        ('geo_name', pa.string()),
+        ('bezirk_name', pa.string()),
+        ('kanton_name', pa.string()),
+        ('period_ref', pa.date32()),
+        ('indicator_id', pa.int64()),
+        ('indicator_name', pa.string()),
+        ('indicator_unit', pa.string()),
+        ('indicator_value_numeric', pa.float64()),
+    ]
+)
+
+MIME_TYPES = {
+    'csv': 'text/csv',
+    'parquet': 'application/vnd.apache.parquet',
+}
+
+
+def _filtered_table(
+    indicator_id: int,
+    geo_values: list | None,
+    year_lower: int,
+    year_upper: int,
+    cached_indicator_ids: Iterable = (),
+) -> pa.Table:
+    """
+    Get the selected municipalities and years of one indicator, with the columns
+    of LONG_SCHEMA.
+    """
+    table = load_indicator_table(
+        indicator_id, cached=indicator_id in cached_indicator_ids
+    )
+    years = pc.year(table['period_ref'])
+    mask = pc.and_(
+        pc.greater_equal(years, year_lower), pc.less_equal(years, year_upper)
+    )
+    if geo_values:
+        mask = pc.and_(mask, pc.is_in(table['geo_value'], pa.array(geo_values)))
+    table = table.filter(mask)
+    return pa.table(
+        {
+            f.name: (
+                table[f.name].cast(f.type, safe=False)
+                if f.name in table.column_names
+                else pa.nulls(table.num_rows, f.type)
+            )
+            for f in LONG_SCHEMA
+        },
+        schema=LONG_SCHEMA,
+    )
+
+
+def wide_column_name(indicator: dict) -> str:
+    return f"{indicator['indicator_id']}: {indicator['indicator_name']} ({indicator['indicator_unit']})"
+
+
+def wide_schema(indicators: list, indicator_ids: list) -> pa.Schema:
+    """
+    Schema of the wide layout, GEO_COLUMNS and one column per indicator.
+    """
+    names = {i['indicator_id']: wide_column_name(i) for i in indicators}
+    return pa.schema(
+        [LONG_SCHEMA.field(c) for c in GEO_COLUMNS]
+        + [pa.field(names.get(i, str(i)), pa.float64()) for i in indicator_ids]
+    )
+
+
+def iter_long_batches(
+    indicator_ids: list,
+    geo_values: list | None,
+    year_lower: int,
+    year_upper: int,
+    cached_indicator_ids: Iterable = (),
+) -> Iterator[pa.RecordBatch]:
+    """
+    Yield one record batch per indicator, one row per municipality, period and
+    indicator. Only one indicator table is held in memory at a time.
+    """
+    for indicator_id in indicator_ids:
+        with metrics.span('export.indicator', indicator_id=indicator_id) as _span:
+            table = _filtered_table(
+                indicator_id, geo_values, year_lower, year_upper, cached_indicator_ids
+            )
+            _span.rows = table.num_rows
+        yield from table.combine_chunks().to_batches()
+
+
+def iter_wide_batches(
+    indicators: list,
+    indicator_ids: list,
+    geo_values: list | None,
+    year_lower: int,
+    year_upper: int,
+    cached_indicator_ids: Iterable = (),
+) -> Iterator[pa.RecordBatch]:
+    """
+    Yield one record batch per period, one row per municipality and one column
+    per indicator. The indicator tables are read one after the other and only
+    their selected values are kept, but the whole export is joined in memory
+    before the first batch is yielded.
+    """
+    schema = wide_schema(indicators, indicator_ids)
+    columns = dict(zip(indicator_ids, schema.names[len(GEO_COLUMNS) :]))
+    values = []
+    municipalities = []
+    for indicator_id in indicator_ids:
+        with metrics.span('export.indicator', indicator_id=indicator_id) as _span:
+            _df = _filtered_table(
+                indicator_id, geo_values, year_lower, year_upper, cached_indicator_ids
+            ).to_pandas()
+            _span.rows = len(_df.index)
+        _df = _df.drop_duplicates(['period_ref', 'geo_value'])
+        municipalities.append(_df[GEO_COLUMNS])
+        values.append(
+            _df.set_index(['period_ref', 'geo_value'])[
+                'indicator_value_numeric'
+            ].rename(columns[indicator_id])
+        )
+    if not values:
+        return
+    df_wide = (
+        pd.concat(municipalities)
+        .drop_duplicates(['period_ref', 'geo_value'])
+        .set_index(['period_ref', 'geo_value'])
+        .join(pd.concat(values, axis=1))
+        .sort_index()
+    )
+    for _, _df in df_wide.groupby(level='period_ref', sort=True):
+        yield pa.RecordBatch.from_pandas(
+            _df.reset_index()[schema.names], schema=schema, preserve_index=False
+        )
+
+
+class _ChunkSink(io.RawIOBase):
+    """
+    Write-only file collecting the bytes written since the last take(). The
+    position keeps counting, as the parquet writer stores file offsets.
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def tell(self) -> int:
+        return self._position
+
+    def take(self) -> bytes:
+        chunk = b''.join(self._chunks)
+        self._chunks = []
+        return chunk
+
+
+def iter_csv_chunks(
+    batches: Iterable[pa.RecordBatch], schema: pa.Schema
+) -> Iterator[bytes]:
+    """
+    Write the record batches as CSV and yield the written bytes. The header is
+    written even without any batch.
+    """
+    sink = _ChunkSink()
+    writer = pa_csv.CSVWriter(sink, schema)
+    for batch in batches:
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def iter_parquet_chunks(
+    batches: Iterable[pa.RecordBatch], schema: pa.Schema
+) -> Iterator[bytes]:
+    """
+    Write every record batch as its own row group and yield the written bytes.
+    The footer is written with the last chunk, so the file is valid even
+    without any batch.
+    """
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='zstd')
+    for batch in batches:
+        writer.write_batch(batch)
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def iter_export(
+    indicators: list,
+    indicator_ids: list,
+    geo_values: list | None,
+    year_lower: int,
+    year_upper: int,
+    layout: Literal['long', 'wide'] = 'long',
+    format: Literal['csv', 'parquet'] = 'csv',
+    cached_indicator_ids: Iterable = (),
+) -> Iterator[bytes]:
+    """
+    Stream the selected indicators, municipalities (None for all) and years as
+    joined table in chunks of bytes. The indicators in cached_indicator_ids are
+    taken from the Streamlit cache of load_indicator, as they are already
+    loaded by the app.
+    """
+    if layout == 'wide':
+        schema = wide_schema(indicators, indicator_ids)
+        batches = iter_wide_batches(
+            indicators,
+            indicator_ids,
+            geo_values,
+            year_lower,
+            year_upper,
+            cached_indicator_ids,
+        )
+    else:
+        schema = LONG_SCHEMA
+        batches = iter_long_batches(
+            indicator_ids, geo_values, year_lower, year_upper, cached_indicator_ids
+        )
+    if format == 'parquet':
+        return iter_parquet_chunks(batches, schema)
+    return iter_csv_chunks(batches, schema)
+
+
+def export_file(*args, **kwargs) -> bytes:
+    """
+    Get the whole export of iter_export as bytes for st.download_button, which
+    needs the complete file. The chunks are joined without an extra copy.
+    """
+    with metrics.span('export.file') as _span:
+        data = b''.join(iter_export(*args, **kwargs))
+        _span.bytes = len(data)
+    return data
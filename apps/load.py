@@ -1,21 +1,40 @@
 import datetime as dt
+import hashlib
 import io
 import logging
 import os
+import tempfile
+from pathlib import Path
 from typing import Literal
 
-import geopandas as gpd
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
 import pyarrow.parquet as pq
 import requests
 import streamlit as st
 from dotenv import load_dotenv
-from shapely import wkb
+
+import metrics
 
 load_dotenv()
 
 DEFAULT_CACHE_DURATION = 60 * 60 * 24  # 24 hours
 
+# Optional directory for memory-mapped Arrow IPC copies of the downloaded
+# tables, for a faster warm start without downloading again. Can be shared by
+# all dashboard processes on the same host.
+ARROW_CACHE_DIR = os.getenv('ODAPI__ARROW_CACHE_DIR')
+
+# When a cached Arrow table expires, revalidate it with a conditional request
+# (ETag / Last-Modified) instead of downloading the whole dataset again. Only
+# effective with ARROW_CACHE_DIR set, as the revalidated table is the Arrow
+# copy. Without it (the default), an expired entry is downloaded again.
+INCREMENTAL_REFRESH = os.getenv('ODAPI__INCREMENTAL_REFRESH', 'true') == 'true'
+
+_ETAG_KEY = b'odapi.etag'
+_LAST_MODIFIED_KEY = b'odapi.last_modified'
+
 
 class OdapiLoadException(Exception):
     pass
@@ -39,6 +58,23 @@ class OdapiWrapper:
         else:
             return f'{self.BASE_URL}/municipalities/{year}/{format}'
 
+    def url_portrait_polg(
+        self,
+        geo_value: int,
+        format: Literal['json', 'parquet'],
+        join_indicator: Literal['true', 'false'] = 'true',
+    ) -> str:
+        if format == 'json':
+            return f'{self.BASE_URL}/portrait/polg/{geo_value}?join_indicator={join_indicator}'
+        else:
+            return f'{self.BASE_URL}/portrait/polg/{geo_value}/{format}?join_indicator={join_indicator}'
+
+    def url_values_polg(self, format: Literal['json', 'parquet']) -> str:
+        if format == 'json':
+            return f'{self.BASE_URL}/values/polg'
+        else:
+            return f'{self.BASE_URL}/values/polg/{format}'
+
     def url_indicator_polg(
         self,
         indicator_id: int,
@@ -65,43 +101,277 @@ class OdapiWrapper:
             )
 
 
+def _arrow_cache_path(name: str, url: str) -> Path | None:
+    """
+    Get the path of the Arrow IPC cache file for the given name, if caching is enabled.
+    The file name contains a hash of the request URL, so that ODAPI instances and
+    request parameters (e.g. the geometry mode) sharing a directory never mix.
+    """
+    if not ARROW_CACHE_DIR:
+        return None
+    url_hash = hashlib.sha1(url.encode()).hexdigest()[:12]
+    return Path(ARROW_CACHE_DIR) / f'{name}-{url_hash}.arrow'
+
+
+def _read_arrow_cache(name: str, url: str) -> tuple[pa.Table | None, bool]:
+    """
+    Memory-map a cached Arrow IPC file, if it exists. This avoids downloading and
+    parsing the parquet file again, e.g. after a restart. The loaders convert the
+    table to pandas and st.cache_data keeps its own copy, so the memory is not
+    shared between processes. The second return value tells whether the file is
+    still fresh (not older than DEFAULT_CACHE_DURATION).
+    """
+    path = _arrow_cache_path(name, url)
+    if path is None or not path.exists():
+        return None, False
+    is_fresh = (
+        dt.datetime.now().timestamp() - path.stat().st_mtime <= DEFAULT_CACHE_DURATION
+    )
+    try:
+        logging.debug(f'Memory-mapping Arrow IPC cache {path}.')
+        with pa.memory_map(str(path), 'r') as source:
+            return pa.ipc.open_file(source).read_all(), is_fresh
+    except (OSError, pa.ArrowInvalid):
+        logging.warning(f'Ignoring unreadable Arrow IPC cache {path}.')
+        return None, False
+
+
+def _touch_arrow_cache(name: str, url: str) -> None:
+    """
+    Mark a cached Arrow IPC file as fresh again, after ODAPI confirmed it is unchanged.
+    """
+    path = _arrow_cache_path(name, url)
+    if path is not None:
+        try:
+            os.utime(path)
+        except OSError:
+            logging.warning(f'Could not touch Arrow IPC cache {path}.')
+
+
+def _write_arrow_cache(name: str, url: str, table: pa.Table) -> None:
+    """
+    Write the table as an uncompressed Arrow IPC file (required for memory-mapping).
+    The file is written to a temporary path first and then renamed, so that
+    concurrent readers never see a partially written file.
+    """
+    path = _arrow_cache_path(name, url)
+    if path is None:
+        return
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Unique per write, as threads of one process may write the same table.
+        fd, tmp_path = tempfile.mkstemp(
+            dir=path.parent, prefix=f'{path.name}.', suffix='.tmp'
+        )
+        os.close(fd)
+        try:
+            with pa.OSFile(tmp_path, 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            os.replace(tmp_path, path)
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+    except OSError:
+        logging.warning(f'Could not write Arrow IPC cache {path}.')
+
+
+def _conditional_headers(table: pa.Table) -> dict:
+    """
+    Build the headers for revalidating a cached table with ODAPI.
+    """
+    metadata = table.schema.metadata or {}
+    headers = {}
+    if _ETAG_KEY in metadata:
+        headers['If-None-Match'] = metadata[_ETAG_KEY].decode()
+    if _LAST_MODIFIED_KEY in metadata:
+        headers['If-Modified-Since'] = metadata[_LAST_MODIFIED_KEY].decode()
+    return headers
+
+
+def _load_parquet_table(url: str, cache_name: str, error_message: str) -> pa.Table:
+    """
+    Load a parquet file from ODAPI as pyarrow table, using the Arrow IPC cache if enabled.
+    An expired cache entry is revalidated with a conditional request first and
+    only downloaded again, if ODAPI reports a change.
+    """
+    with metrics.span('arrow_cache_read') as _span:
+        cached_table, is_fresh = _read_arrow_cache(cache_name, url)
+        if cached_table is None:
+            _span.cache = 'miss'
+        else:
+            _span.cache = 'hit' if is_fresh else 'stale'
+            _span.rows = cached_table.num_rows
+            _span.bytes = cached_table.nbytes
+    if cached_table is not None and is_fresh:
+        return cached_table
+    headers = {}
+    if cached_table is not None and INCREMENTAL_REFRESH:
+        headers = _conditional_headers(cached_table)
+    with metrics.span('download') as _span:
+        try:
+            logging.debug(f'Loading parquet data from {url}')
+            response = requests.get(url, headers=headers)
+            response.raise_for_status()
+        except requests.RequestException:
+            raise OdapiLoadException(error_message)
+        _span.bytes = len(response.content)
+        _span.cache = 'not_modified' if response.status_code == 304 else 'miss'
+    if response.status_code == 304 and cached_table is not None:
+        logging.debug(f'Cached data for {cache_name} is unchanged on ODAPI.')
+        _touch_arrow_cache(cache_name, url)
+        return cached_table
+    with metrics.span('parquet_read') as _span:
+        logging.debug(f'Load buffer from ODAPI response.')
+        buffer = io.BytesIO(response.content)
+        logging.debug(f'Reading into pyarrow table.')
+        table = pq.read_table(buffer)
+        _span.rows = table.num_rows
+    metadata = dict(table.schema.metadata or {})
+    if 'ETag' in response.headers:
+        metadata[_ETAG_KEY] = response.headers['ETag'].encode()
+    if 'Last-Modified' in response.headers:
+        metadata[_LAST_MODIFIED_KEY] = response.headers['Last-Modified'].encode()
+    table = table.replace_schema_metadata(metadata)
+    with metrics.span('arrow_cache_write') as _span:
+        _write_arrow_cache(cache_name, url, table)
+        _span.bytes = table.nbytes
+    return table
+
+
+def _group_fingerprints(df: pd.DataFrame, by: str = 'period_ref') -> dict:
+    """
+    Hash the rows of every group (by default every period_ref). Derived results
+    (figures, tables, stats) use the fingerprint of the groups they are built
+    from as cache key, so that a refresh only invalidates the groups which
+    actually changed.
+    """
+    hashes = pd.util.hash_pandas_object(df, index=False)
+    return {
+        str(key): f'{value:016x}'
+        for key, value in hashes.groupby(df[by]).sum().items()
+    }
+
+
+def period_fingerprint(df: pd.DataFrame, *period_refs) -> str:
+    """
+    Get a combined fingerprint of the given periods of an indicator DataFrame
+    returned by load_indicator.
+    """
+    fingerprints = df.attrs.get('period_fingerprints', {})
+    return '-'.join(fingerprints.get(str(p), '') for p in period_refs)
+
+
+def has_period_fingerprints(df: pd.DataFrame, *period_refs) -> bool:
+    """
+    Check whether the fingerprints of all given periods are known, i.e. whether
+    period_fingerprint identifies their content.
+    """
+    fingerprints = df.attrs.get('period_fingerprints', {})
+    return all(str(p) in fingerprints for p in period_refs)
+
+
+@metrics.timed('load_indicator', cached=True)
 @st.cache_data(ttl=DEFAULT_CACHE_DURATION)
 def load_indicator(sel_indicator_id: int) -> pd.DataFrame:
+    # Imported here, as geopandas and shapely are only needed for indicator data
+    # and take a noticeable part of the app startup time.
+    import geopandas as gpd
+    from shapely import wkb
+
     url = OdapiWrapper().url_indicator_polg(sel_indicator_id, 'parquet')
-    try:
-        logging.debug(f'Loading indicator data from {url}')
-        response = requests.get(url)
-        response.raise_for_status()
-    except requests.RequestException:
-        raise OdapiLoadException(
-            f'Error loading indicator data for indicator {sel_indicator_id}.'
-        )
-    logging.debug(f'Load buffer from ODAPI response.')
-    buffer = io.BytesIO(response.content)
-    logging.debug(f'Reading into pyarrow table.')
-    table = pq.read_table(buffer)
-    logging.debug(f'Converting to pandas DataFrame.')
-    df = table.to_pandas()
-    logging.debug(f'Transform geometry column from WKB to Shapely geometries.')
-    df['geometry'] = df['geometry'].apply(wkb.loads)
-    logging.debug(f'Generate GeoDataFrame from DataFrame.')
-    gdf = gpd.GeoDataFrame(df, geometry='geometry').sort_values('period_ref')
+    table = _load_parquet_table(
+        url,
+        f'indicator_polg_{sel_indicator_id}',
+        f'Error loading indicator data for indicator {sel_indicator_id}.',
+    )
+    with metrics.span('to_pandas') as _span:
+        logging.debug(f'Converting to pandas DataFrame.')
+        df = table.to_pandas()
+        _span.rows = len(df.index)
+    with metrics.span('period_fingerprints'):
+        fingerprints = _group_fingerprints(df)
+    with metrics.span('wkb_decode') as _span:
+        logging.debug(f'Transform geometry column from WKB to Shapely geometries.')
+        df['geometry'] = wkb.loads(df['geometry'].to_numpy())
+        _span.rows = len(df.index)
+    with metrics.span('geodataframe_sort'):
+        logging.debug(f'Generate GeoDataFrame from DataFrame.')
+        gdf = gpd.GeoDataFrame(df, geometry='geometry').sort_values('period_ref')
+    gdf.attrs['period_fingerprints'] = fingerprints
     return gdf
 
 
+def load_indicator_table(sel_indicator_id: int, cached: bool = False) -> pa.Table:
+    """
+    Get the indicator data without geometries as pyarrow table, e.g. for exports.
+    With cached=True, the cached DataFrame of load_indicator is reused, which
+    should only be done for indicators already loaded by the app. Otherwise the
+    parquet file is requested with point geometries and read without decoding
+    them and without keeping the indicator in the Streamlit cache.
+    """
+    if cached:
+        df = pd.DataFrame(load_indicator(sel_indicator_id).drop(columns='geometry'))
+        return pa.Table.from_pandas(df, preserve_index=False)
+    # The geometries are dropped, so only points are requested.
+    url = OdapiWrapper().url_indicator_polg(
+        sel_indicator_id, 'parquet', geometry_mode='point'
+    )
+    table = _load_parquet_table(
+        url,
+        f'indicator_polg_{sel_indicator_id}',
+        f'Error loading indicator data for indicator {sel_indicator_id}.',
+    )
+    if 'geometry' in table.column_names:
+        table = table.drop_columns(['geometry'])
+    return table
+
+
+@metrics.timed('load_indicator_years', cached=True)
+@st.cache_data(ttl=DEFAULT_CACHE_DURATION)
+def load_indicator_years(sel_indicator_id: int, cached: bool = False) -> list:
+    """
+    Get the sorted years with data of an indicator, see load_indicator_table for
+    the cached flag.
+    """
+    table = load_indicator_table(sel_indicator_id, cached=cached)
+    return sorted(pc.unique(pc.year(table['period_ref'])).to_pylist())
+
+
+@metrics.timed('load_indicators', cached=True)
 @st.cache_data(ttl=DEFAULT_CACHE_DURATION)
 def load_indicators() -> dict:
     url = OdapiWrapper().url_indicators_polg('json')
-    try:
-        response = requests.get(url)
-        response.raise_for_status()
-    except requests.RequestException:
-        raise OdapiLoadException('Error loading indicators data.')
+    with metrics.span('download') as _span:
+        try:
+            response = requests.get(url)
+            response.raise_for_status()
+        except requests.RequestException:
+            raise OdapiLoadException('Error loading indicators data.')
+        _span.bytes = len(response.content)
     return response.json()
 
 
+@metrics.timed('load_municipalities', cached=True)
 @st.cache_data(ttl=DEFAULT_CACHE_DURATION)
 def load_municipalities() -> pd.DataFrame:
     year = dt.datetime.now().year - 1
     url = OdapiWrapper().url_municipalities_parquet('parquet', year)
-    return pd.read_parquet(url)
+    table = _load_parquet_table(
+        url, f'municipalities_{year}', 'Error loading municipalities data.'
+    )
+    return table.to_pandas()
+
+
+@metrics.timed('load_values', cached=True)
+@st.cache_data(ttl=DEFAULT_CACHE_DURATION)
+def load_values() -> pd.DataFrame:
+    """
+    Load the values of all indicators for all municipalities.
+    """
+    url = OdapiWrapper().url_values_polg('parquet')
+    table = _load_parquet_table(url, 'values_polg', 'Error loading values data.')
+    df = table.to_pandas()
+    with metrics.span('indicator_fingerprints'):
+        df.attrs['indicator_fingerprints'] = _group_fingerprints(df, 'indicator_id')
+    return df
@@ -0,0 +1,275 @@
+import contextlib
+import functools
+import http.server
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from dataclasses import field
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Prometheus text export: written to a file after every rerun and/or served on
+# a separate port (Streamlit itself does not allow custom routes).
+METRICS_FILE = os.getenv('DASH__METRICS_FILE')
+METRICS_PORT = os.getenv('DASH__METRICS_PORT')
+METRICS_HOST = os.getenv('DASH__METRICS_HOST', '127.0.0.1')
+SHOW_PERFORMANCE = os.getenv('DASH__SHOW_PERFORMANCE', 'false') == 'true'
+
+METRIC_PREFIX = 'odapi_dashboard'
+
+
+@dataclass
+class Span:
+    stage: str
+    labels: dict = field(default_factory=dict)
+    depth: int = 0
+    duration: float = 0.0
+    bytes: int | None = None
+    rows: int | None = None
+    cache: str | None = None
+    children: int = 0
+
+
+class _Registry:
+    """
+    Process wide totals per stage, shared by all sessions.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.seconds_sum = defaultdict(float)
+        self.seconds_count = defaultdict(int)
+        self.bytes_total = defaultdict(int)
+        self.rows_total = defaultdict(int)
+        self.cache_total = defaultdict(int)
+        # Stages wrapping a st.cache_data function (span(cached=True)). Other
+        # stages may label their spans as well, e.g. a download as 'miss'.
+        self.cached_stages = set()
+
+    def add(self, span: Span, cached: bool = False):
+        with self.lock:
+            if cached:
+                self.cached_stages.add(span.stage)
+            self.seconds_sum[span.stage] += span.duration
+            self.seconds_count[span.stage] += 1
+            if span.bytes is not None:
+                self.bytes_total[span.stage] += span.bytes
+            if span.rows is not None:
+                self.rows_total[span.stage] += span.rows
+            if span.cache is not None:
+                self.cache_total[(span.stage, span.cache)] += 1
+
+
+_registry = _Registry()
+_local = threading.local()
+_server_lock = threading.Lock()
+_server = None
+
+
+def _spans() -> list | None:
+    """
+    Get the span list of the script run on this thread. Threads without a
+    script run (e.g. running a deferred download) only add to the totals.
+    """
+    return getattr(_local, 'spans', None)
+
+
+def _stack() -> list:
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def start_rerun():
+    """
+    Reset the spans of the current script run. Call at the top of an app.
+    """
+    _local.spans = []
+    _local.stack = []
+    if METRICS_PORT:
+        _start_server(METRICS_HOST, int(METRICS_PORT))
+
+
+def finish_rerun():
+    """
+    Stop recording the spans of the script run and export the totals, if a
+    metrics file is configured. Call at the end of an app.
+    """
+    _local.spans = None
+    if METRICS_FILE:
+        # Sessions run as threads of one process, every rerun writes its own
+        # temporary file.
+        directory, name = os.path.split(os.path.abspath(METRICS_FILE))
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                dir=directory, prefix=f'{name}.', suffix='.tmp'
+            )
+            try:
+                with os.fdopen(fd, 'w') as f:
+                    f.write(export_prometheus())
+                os.replace(tmp_path, METRICS_FILE)
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+        except OSError:
+            logging.warning(f'Could not write metrics file {METRICS_FILE}.')
+
+
+@contextlib.contextmanager
+def span(stage: str, cached: bool = False, **labels):
+    """
+    Measure the duration of a stage. Set `bytes` and `rows` on the yielded span
+    to record payload sizes. For `cached=True` spans wrapping a st.cache_data
+    function, the cache result is derived from whether any nested span ran
+    (the function body only runs on a cache miss).
+    """
+    spans = _spans()
+    stack = _stack()
+    _span = Span(stage=stage, labels=labels, depth=len(stack))
+    if stack:
+        stack[-1].children += 1
+    if spans is not None:
+        spans.append(_span)
+    stack.append(_span)
+    start = time.perf_counter()
+    try:
+        yield _span
+    finally:
+        _span.duration = time.perf_counter() - start
+        stack.pop()
+        if cached and _span.cache is None:
+            _span.cache = 'miss' if _span.children > 0 else 'hit'
+        _registry.add(_span, cached)
+
+
+def timed(stage: str, cached: bool = False):
+    """
+    Decorator version of span(). Records the row count of a returned DataFrame,
+    otherwise of the first DataFrame argument.
+    """
+
+    def decorator(func):
+        # Imported on decoration, i.e. with the data modules, as the apps import
+        # this module before the page shell is sent and pandas takes most of
+        # the startup time.
+        import pandas as pd
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage, cached=cached) as _span:
+                result = func(*args, **kwargs)
+                if isinstance(result, pd.DataFrame):
+                    _span.rows = len(result.index)
+                else:
+                    _df = next(
+                        (a for a in args if isinstance(a, pd.DataFrame)), None
+                    )
+                    if _df is not None:
+                        _span.rows = len(_df.index)
+                return result
+
+        return wrapper
+
+    return decorator
+
+
+def df_current_rerun():
+    """
+    Get the spans of the current script run as DataFrame for the performance panel.
+    """
+    import pandas as pd
+
+    return pd.DataFrame(
+        [
+            {
+                'Stage': ' ' * s.depth + s.stage,
+                'Labels': ', '.join(f'{k}={v}' for k, v in s.labels.items()),
+                'Dauer (ms)': round(s.duration * 1000, 1),
+                'Bytes': s.bytes,
+                'Zeilen': s.rows,
+                'Cache': s.cache,
+            }
+            for s in _spans() or []
+        ],
+        columns=['Stage', 'Labels', 'Dauer (ms)', 'Bytes', 'Zeilen', 'Cache'],
+    )
+
+
+def cache_counts() -> dict:
+    """
+    Get the process wide cache hit/miss counts per stage.
+    """
+    with _registry.lock:
+        return dict(_registry.cache_total)
+
+
+def cached_stages() -> set:
+    """
+    Get the stages measured with span(cached=True), i.e. the st.cache_data
+    functions, whose hit/miss counts reflect the cache behaviour.
+    """
+    with _registry.lock:
+        return set(_registry.cached_stages)
+
+
+def export_prometheus() -> str:
+    """
+    Render the process wide totals in the Prometheus text exposition format.
+    """
+    lines = []
+    with _registry.lock:
+        lines.append(f'# TYPE {METRIC_PREFIX}_stage_seconds summary')
+        for stage, value in sorted(_registry.seconds_sum.items()):
+            lines.append(f'{METRIC_PREFIX}_stage_seconds_sum{{stage="{stage}"}} {value}')
+            lines.append(
+                f'{METRIC_PREFIX}_stage_seconds_count{{stage="{stage}"}} '
+                f'{_registry.seconds_count[stage]}'
+            )
+        lines.append(f'# TYPE {METRIC_PREFIX}_stage_bytes_total counter')
+        for stage, value in sorted(_registry.bytes_total.items()):
+            lines.append(f'{METRIC_PREFIX}_stage_bytes_total{{stage="{stage}"}} {value}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_stage_rows_total counter')
+        for stage, value in sorted(_registry.rows_total.items()):
+            lines.append(f'{METRIC_PREFIX}_stage_rows_total{{stage="{stage}"}} {value}')
+        lines.append(f'# TYPE {METRIC_PREFIX}_cache_requests_total counter')
+        for (stage, result), value in sorted(_registry.cache_total.items()):
+            lines.append(
+                f'{METRIC_PREFIX}_cache_requests_total'
+                f'{{stage="{stage}",result="{result}"}} {value}'
+            )
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = export_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _start_server(host: str, port: int):
+    global _server
+    with _server_lock:
+        if _server is not None:
+            return
+        try:
+            _server = http.server.ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError:
+            # Another replica on this host already serves the endpoint.
+            logging.warning(f'Could not start metrics endpoint on port {port}.')
+            _server = False
+            return
+        threading.Thread(target=_server.serve_forever, daemon=True).start()
@@ -0,0 +1,170 @@
+import threading
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import metrics
+
+# Indicators with values for less municipalities are left out of the features.
+MIN_COVERAGE = 0.5
+
+
+class PeerIndex:
+    """
+    Standardized municipality × indicator feature matrix for one year, used to
+    find the most similar municipalities (peers) of a municipality.
+
+    Every indicator is standardized to a z-score, missing values are set to the
+    mean (0). Peers are the nearest neighbours by euclidean distance over the
+    z-scores, computed vectorized from the precomputed squared row norms
+    (|a - b|² = |a|² + |b|² - 2 a·b), which answers a query over all
+    municipalities in about a millisecond.
+    """
+
+    def __init__(
+        self,
+        year: int,
+        geo_values: np.ndarray,
+        indicator_ids: np.ndarray,
+        features: np.ndarray,
+        fingerprints: dict,
+    ):
+        self.year = year
+        self.geo_values = geo_values
+        self.indicator_ids = indicator_ids
+        self.features = features
+        self.fingerprints = fingerprints
+        self._geo_positions = {g: i for i, g in enumerate(geo_values)}
+        self._sq_norms = np.einsum('ij,ij->i', features, features)
+
+    @staticmethod
+    def df_year(df_values: pd.DataFrame, year: int) -> pd.DataFrame:
+        """
+        Get the latest value per municipality and indicator up to the given year.
+        """
+        _df = df_values[df_values['period_ref'].dt.year <= year]
+        return _df.sort_values('period_ref').drop_duplicates(
+            ['geo_value', 'indicator_id'], keep='last'
+        )
+
+    @staticmethod
+    def _standardize(df_year: pd.DataFrame, geo_values: np.ndarray) -> pd.DataFrame:
+        _df = df_year.pivot(
+            index='geo_value', columns='indicator_id', values='indicator_value_numeric'
+        ).reindex(geo_values)
+        _df = _df.loc[:, _df.notna().mean() >= MIN_COVERAGE]
+        std = _df.std()
+        _df = _df.loc[:, std > 0]
+        return ((_df - _df.mean()) / std[_df.columns]).fillna(0.0)
+
+    @classmethod
+    @metrics.timed('PeerIndex.build')
+    def build(
+        cls, df_values: pd.DataFrame, year: int, previous: 'PeerIndex | None' = None
+    ) -> 'PeerIndex':
+        """
+        Build the index for the given year. If a previous index for the same year
+        and municipalities is given, only the columns of indicators with a changed
+        fingerprint are standardized again.
+        """
+        fingerprints = df_values.attrs.get('indicator_fingerprints', {})
+        _df_year = cls.df_year(df_values, year)
+        geo_values = np.sort(_df_year['geo_value'].unique())
+        if previous is not None and not np.array_equal(previous.geo_values, geo_values):
+            previous = None
+
+        unchanged = set()
+        if previous is not None:
+            unchanged = {
+                i
+                for i in previous.indicator_ids
+                if fingerprints.get(str(i)) is not None
+                and fingerprints.get(str(i)) == previous.fingerprints.get(str(i))
+            }
+        _df_changed = _df_year[~_df_year['indicator_id'].isin(unchanged)]
+        columns = cls._standardize(_df_changed, geo_values)
+        if unchanged:
+            positions = [
+                i for i, ind in enumerate(previous.indicator_ids) if ind in unchanged
+            ]
+            reused = pd.DataFrame(
+                previous.features[:, positions],
+                index=geo_values,
+                columns=previous.indicator_ids[positions],
+            )
+            columns = pd.concat([reused, columns], axis=1)
+        columns = columns.sort_index(axis=1)
+        return cls(
+            year=year,
+            geo_values=geo_values,
+            indicator_ids=columns.columns.to_numpy(),
+            features=np.ascontiguousarray(columns.to_numpy(dtype=np.float64)),
+            fingerprints=fingerprints,
+        )
+
+    @metrics.timed('PeerIndex.peers')
+    def peers(
+        self, geo_value: int, k: int = 10, indicator_ids: list | None = None
+    ) -> pd.DataFrame:
+        """
+        Get the k nearest municipalities of the given one, optionally only
+        considering a subset of the indicators.
+        """
+        if geo_value not in self._geo_positions:
+            return pd.DataFrame(columns=['geo_value', 'distance'])
+        position = self._geo_positions[geo_value]
+        if indicator_ids:
+            mask = np.isin(self.indicator_ids, indicator_ids)
+            features = self.features[:, mask]
+            sq_norms = np.einsum('ij,ij->i', features, features)
+        else:
+            features = self.features
+            sq_norms = self._sq_norms
+        if features.shape[1] == 0:
+            return pd.DataFrame(columns=['geo_value', 'distance'])
+        sq_distances = sq_norms + sq_norms[position] - 2 * (features @ features[position])
+        sq_distances[position] = np.inf
+        k = min(k, len(self.geo_values) - 1)
+        nearest = np.argpartition(sq_distances, k)[:k]
+        nearest = nearest[np.argsort(sq_distances[nearest])]
+        # Scale by the number of indicators, so that distances are comparable
+        # between different indicator selections.
+        return pd.DataFrame(
+            {
+                'geo_value': self.geo_values[nearest],
+                'distance': np.sqrt(np.maximum(sq_distances[nearest], 0))
+                / np.sqrt(features.shape[1]),
+            }
+        )
+
+    def df_profile(self, geo_values: list) -> pd.DataFrame:
+        """
+        Get the z-scores of the given municipalities (rows) per indicator (columns).
+        """
+        positions = [self._geo_positions[g] for g in geo_values]
+        return pd.DataFrame(
+            self.features[positions], index=geo_values, columns=self.indicator_ids
+        )
+
+
+_lock = threading.Lock()
+
+
+@st.cache_resource(show_spinner=False)
+def _peer_indexes() -> dict:
+    return {}
+
+
+def peer_index(df_values: pd.DataFrame, year: int) -> PeerIndex:
+    """
+    Get the PeerIndex for the given year, shared by all sessions. When the values
+    were refreshed, the index is rebuilt for the changed indicators only.
+    """
+    indexes = _peer_indexes()
+    fingerprints = df_values.attrs.get('indicator_fingerprints', {})
+    with _lock:
+        previous = indexes.get(year)
+        if previous is None or previous.fingerprints != fingerprints:
+            indexes[year] = PeerIndex.build(df_values, year, previous)
+        return indexes[year]
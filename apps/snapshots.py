@@ -0,0 +1,140 @@
+import contextlib
+import gzip
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Any
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Directory with prebuilt snapshots of the derived figures and tables (see
+# build_snapshots.py). Snapshots are keyed by the content fingerprints of the
+# periods they are built from, so a snapshot of outdated data is never served.
+SNAPSHOT_DIR = os.getenv('ODAPI__SNAPSHOT_DIR')
+
+# Decimal places of the map borders in snapshots (5 digits are about 1 m).
+COORDINATE_DIGITS = 5
+
+# Directory the snapshots are written to while building, see recording().
+_recording_dir = None
+
+
+def _snapshot_path(
+    directory: str, name: str, sel_indicator_id: int, key: str
+) -> Path:
+    digest = hashlib.sha1(f'{name}/{key}'.encode()).hexdigest()[:20]
+    return Path(directory) / str(sel_indicator_id) / f'{name}-{digest}.json.gz'
+
+
+@contextlib.contextmanager
+def recording(directory: str):
+    """
+    Write every result passing through load_or_build() to the given directory,
+    instead of reading snapshots.
+    """
+    global _recording_dir
+    _recording_dir = directory
+    try:
+        yield
+    finally:
+        _recording_dir = None
+
+
+def _round_coordinates(geometry: Any) -> Any:
+    if isinstance(geometry, float):
+        return round(geometry, COORDINATE_DIGITS)
+    if isinstance(geometry, list):
+        return [_round_coordinates(g) for g in geometry]
+    return geometry
+
+
+def _compact_geojson(figure: dict) -> dict:
+    """
+    Round the coordinates of the map borders, they make up most of the size of
+    a map snapshot.
+    """
+    for trace in figure.get('data', []):
+        for feature in (trace.get('geojson') or {}).get('features', []):
+            geometry = feature.get('geometry') or {}
+            if 'coordinates' in geometry:
+                geometry['coordinates'] = _round_coordinates(geometry['coordinates'])
+    return figure
+
+
+def _serialize(result: Any) -> dict:
+    import pandas as pd
+    import plotly.io as pio
+
+    if isinstance(result, pd.DataFrame):
+        return {
+            'type': 'dataframe',
+            'data': json.loads(result.to_json(orient='split', index=False)),
+        }
+    return {
+        'type': 'figure',
+        'data': _compact_geojson(
+            json.loads(pio.to_json(result, validate=False, remove_uids=True))
+        ),
+    }
+
+
+def _deserialize(snapshot: dict) -> Any:
+    import pandas as pd
+
+    if snapshot['type'] == 'dataframe':
+        return pd.DataFrame(
+            snapshot['data']['data'], columns=snapshot['data']['columns']
+        )
+    # st.plotly_chart accepts the figure dict directly. Not building a
+    # go.Figure saves a full validation of the figure.
+    return snapshot['data']
+
+
+def _write(name: str, sel_indicator_id: int, key: str, result: Any) -> None:
+    path = _snapshot_path(_recording_dir, name, sel_indicator_id, key)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(f'.{os.getpid()}.tmp')
+    body = json.dumps(_serialize(result), separators=(',', ':')).encode()
+    tmp_path.write_bytes(gzip.compress(body, compresslevel=6))
+    os.replace(tmp_path, path)
+
+
+def _read(name: str, sel_indicator_id: int, key: str) -> Any | None:
+    path = _snapshot_path(SNAPSHOT_DIR, name, sel_indicator_id, key)
+    with metrics.span('snapshot_read', name=name) as _span:
+        try:
+            body = path.read_bytes()
+        except FileNotFoundError:
+            _span.cache = 'miss'
+            return None
+        except OSError:
+            logging.warning(f'Could not read snapshot {path}.')
+            _span.cache = 'miss'
+            return None
+        _span.cache = 'hit'
+        _span.bytes = len(body)
+        return _deserialize(json.loads(gzip.decompress(body)))
+
+
+def load_or_build(name: str, sel_indicator_id: int, key: str, build) -> Any:
+    """
+    Get the snapshot of a derived result, if one exists for the given key,
+    otherwise build it. The key must contain all inputs of the result (period
+    fingerprints and further arguments), so results of periods without
+    fingerprint must not be passed (see load.has_period_fingerprints).
+    """
+    if _recording_dir is not None:
+        result = build()
+        _write(name, sel_indicator_id, key, result)
+        return result
+    if SNAPSHOT_DIR:
+        result = _read(name, sel_indicator_id, key)
+        if result is not None:
+            return result
+    return build()
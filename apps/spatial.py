@@ -0,0 +1,159 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import shapely
+import streamlit as st
+
+import metrics
+
+# Maximum distance (in degrees, ~150 m) between two municipality borders to be
+# considered neighbours. The simplified borders from ODAPI do not always touch.
+ADJACENCY_TOLERANCE = 0.002
+
+# Number of random permutations for the pseudo p-values of Moran's I.
+MORAN_PERMUTATIONS = 99
+MORAN_SIGNIFICANCE = 0.05
+
+LISA_CLUSTERS = {
+    'HH': 'Hoch-Hoch',
+    'LL': 'Tief-Tief',
+    'HL': 'Hoch-Tief',
+    'LH': 'Tief-Hoch',
+    'NS': 'nicht signifikant',
+}
+
+
+def geometry_vintage(df_year: pd.DataFrame) -> str:
+    """
+    Identify the municipality borders of one period by the set of municipalities.
+    Borders only change with municipality mergers, which change the set as well.
+    """
+    geo_values = np.sort(df_year['geo_value'].to_numpy())
+    return hashlib.sha1(geo_values.tobytes()).hexdigest()
+
+
+@st.cache_resource(show_spinner=False, max_entries=32)
+@metrics.timed('spatial.adjacency_matrix')
+def _adjacency_matrix(_geometries: np.ndarray, vintage: str) -> sp.csr_matrix:
+    tree = shapely.STRtree(_geometries)
+    left, right = tree.query(
+        _geometries, predicate='dwithin', distance=ADJACENCY_TOLERANCE
+    )
+    mask = left != right
+    n = len(_geometries)
+    adjacency = sp.coo_matrix(
+        (np.ones(mask.sum()), (left[mask], right[mask])), shape=(n, n)
+    ).tocsr()
+    # dwithin is symmetric, but make sure rounding does not produce one-way links.
+    adjacency = ((adjacency + adjacency.T) > 0).astype(np.float64)
+    return adjacency
+
+
+def adjacency_matrix(df_year: pd.DataFrame) -> tuple[np.ndarray, sp.csr_matrix]:
+    """
+    Get the binary adjacency matrix of the municipalities of one period, built
+    once per geometry vintage with an STRtree and shared by all sessions.
+    Returns the geo_values (sorted, in matrix order) and the matrix.
+    """
+    _df = df_year.sort_values('geo_value')
+    geometries = np.asarray(_df.geometry.values, dtype=object)
+    return _df['geo_value'].to_numpy(), _adjacency_matrix(
+        geometries, geometry_vintage(_df)
+    )
+
+
+def _row_standardize(adjacency: sp.csr_matrix) -> sp.csr_matrix:
+    row_sums = np.asarray(adjacency.sum(axis=1)).ravel()
+    inverse = np.divide(1.0, row_sums, out=np.zeros_like(row_sums), where=row_sums > 0)
+    return sp.diags(inverse) @ adjacency
+
+
+def _pseudo_p_values(observed: np.ndarray, permuted: np.ndarray) -> np.ndarray:
+    """
+    Folded pseudo p-values: share of permutations at least as extreme as the
+    observed value, in the direction of the observed value.
+    """
+    permutations = permuted.shape[-1]
+    larger = (permuted >= observed[..., None]).sum(axis=-1)
+    larger = np.where(permutations - larger < larger, permutations - larger, larger)
+    return (larger + 1) / (permutations + 1)
+
+
+@metrics.timed('spatial.spatial_stats')
+def spatial_stats(
+    df_year: pd.DataFrame,
+    col_name: str = 'indicator_value_numeric',
+    permutations: int = MORAN_PERMUTATIONS,
+    seed: int = 0,
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Compute the global and local Moran's I and the neighbour average of one period.
+    The permutations for the pseudo p-values are done in one sparse product
+    for all municipalities at once.
+
+    Returns a DataFrame per geo_value (neighbour_average, local_moran,
+    local_p_value, lisa_cluster) and a dict with the global Moran's I.
+    """
+    geo_values, adjacency = adjacency_matrix(df_year)
+    values = (
+        df_year.drop_duplicates('geo_value')
+        .set_index('geo_value')[col_name]
+        .reindex(geo_values)
+        .to_numpy(dtype=np.float64)
+    )
+    valid = ~np.isnan(values)
+    adjacency = adjacency[valid][:, valid]
+    weights = _row_standardize(adjacency)
+    has_neighbours = np.asarray(adjacency.sum(axis=1)).ravel() > 0
+    x = values[valid]
+    n = len(x)
+
+    z = x - x.mean()
+    m2 = (z @ z) / n
+    lag = weights @ z
+    s0 = weights.sum()
+    global_i = n / s0 * (z @ lag) / (z @ z) if s0 > 0 and m2 > 0 else np.nan
+    local_i = z * lag / m2 if m2 > 0 else np.zeros(n)
+
+    rng = np.random.default_rng(seed)
+    z_permuted = rng.permuted(np.repeat(z[:, None], permutations, axis=1), axis=0)
+    lag_permuted = weights @ z_permuted
+    global_permuted = n / s0 * (z_permuted * lag_permuted).sum(axis=0) / (z @ z)
+    local_permuted = z[:, None] * lag_permuted / m2 if m2 > 0 else lag_permuted * 0
+
+    global_p = _pseudo_p_values(np.array(global_i), global_permuted)
+    local_p = _pseudo_p_values(local_i, local_permuted)
+
+    cluster = np.select(
+        [
+            (z > 0) & (lag > 0),
+            (z < 0) & (lag < 0),
+            (z > 0) & (lag < 0),
+            (z < 0) & (lag > 0),
+        ],
+        ['HH', 'LL', 'HL', 'LH'],
+        default='NS',
+    )
+    cluster = np.where(
+        (local_p <= MORAN_SIGNIFICANCE) & has_neighbours, cluster, 'NS'
+    )
+
+    df_stats = pd.DataFrame(
+        {
+            'geo_value': geo_values[valid],
+            'neighbour_average': np.where(has_neighbours, lag + x.mean(), np.nan),
+            'local_moran': local_i,
+            'local_p_value': local_p,
+            'lisa_cluster': pd.Series(cluster).map(LISA_CLUSTERS).to_numpy(),
+        }
+    )
+    global_stats = {
+        'moran_i': float(global_i),
+        'expected_i': -1 / (n - 1) if n > 1 else np.nan,
+        'p_value': float(global_p),
+        'municipalities': n,
+        'links': int(adjacency.nnz / 2),
+    }
+    return df_stats, global_stats
@@ -1,7 +1,7 @@
 from typing import Tuple
 
 import pandas as pd
-import plotly.express as px
+import plotly.colors
 
 
 def get_topic_lvl(indicators: dict, indicator_id: int, lvl: int) -> str:
@@ -77,7 +77,7 @@ def decide_colorscale(df: pd.DataFrame, col_name: str = 'indicator_value_numeric
         # return px.colors.sequential.Turbo
         # return px.colors.sequential.Inferno
         # return px.colors.sequential.Magma
-        return px.colors.sequential.Viridis
+        return plotly.colors.sequential.Viridis
         # return [  # Magma
         #     (0.0001, '#000004'),
         #     (0.0300, '#180f3d'),
@@ -0,0 +1,269 @@
+"""
+Load test for app_indikator.py with concurrent sessions against the local ODAPI
+stand-in (see stub_server.py).
+
+    python benchmarks/loadtest.py --sessions 24 --duration 120
+
+Every session is a Streamlit AppTest running in its own thread of this process,
+like sessions share a single Streamlit server process. Sessions repeatedly
+switch the indicator, move the year sliders or change the comparison indicator,
+with a random think time in between. The report contains throughput, rerun
+latency percentiles per interaction, cache hit rates (from the metrics module)
+and the RSS of the process over time.
+"""
+
+import argparse
+import json
+import logging
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from run import APPS_DIR
+from run import start_environment
+from stub_server import StubConfig
+
+INTERACTIONS = {
+    'switch_indicator': 0.2,
+    'move_year': 0.4,
+    'move_year_range': 0.2,
+    'switch_comparison': 0.2,
+}
+
+
+def rss_mb() -> float:
+    """
+    Get the current resident set size of this process in MB.
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    # Fallback for non-Linux systems: peak instead of current RSS.
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return maxrss / 1024 / (1024 if sys.platform == 'darwin' else 1)
+
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def interact(at, interaction: str, rng: random.Random):
+    match interaction:
+        case 'switch_indicator':
+            selectbox = at.selectbox[0]
+            selectbox.select_index(rng.randrange(len(selectbox.options)))
+        case 'switch_comparison':
+            selectbox = at.selectbox[1]
+            selectbox.select_index(rng.randrange(len(selectbox.options)))
+        case 'move_year':
+            slider = at.select_slider[0]
+            slider.set_value(rng.choice(slider.options))
+        case 'move_year_range':
+            slider = at.select_slider[1]
+            lower, upper = sorted(rng.sample(range(len(slider.options)), 2))
+            slider.set_value((slider.options[lower], slider.options[upper]))
+    return at
+
+
+class Session(threading.Thread):
+
+    def __init__(self, idx: int, args, deadline: float, samples: list, lock):
+        super().__init__(daemon=True)
+        self.idx = idx
+        self.args = args
+        self.deadline = deadline
+        self.samples = samples
+        self.lock = lock
+        self.rng = random.Random(args.seed + idx)
+        self.errors = 0
+
+    def _rerun(self, at, interaction: str):
+        start = time.perf_counter()
+        at.run()
+        latency = time.perf_counter() - start
+        if at.exception:
+            self.errors += 1
+            logging.warning(f'Session {self.idx}: {at.exception[0].message}')
+        with self.lock:
+            self.samples.append((time.monotonic(), interaction, latency))
+
+    def run(self):
+        from streamlit.testing.v1 import AppTest
+
+        # Stagger the session starts like users arriving over time.
+        time.sleep(self.rng.uniform(0, self.args.ramp_up))
+        at = AppTest.from_file(
+            str(APPS_DIR / 'app_indikator.py'), default_timeout=self.args.timeout
+        )
+        self._rerun(at, 'initial')
+        while time.monotonic() < self.deadline:
+            time.sleep(self.rng.uniform(0, 2 * self.args.think_time))
+            interaction = self.rng.choices(
+                list(INTERACTIONS), weights=list(INTERACTIONS.values())
+            )[0]
+            try:
+                interact(at, interaction, self.rng)
+            except (IndexError, ValueError) as e:
+                # The page did not render completely (e.g. after an error).
+                logging.warning(f'Session {self.idx}: {interaction} failed: {e}')
+                interaction = 'initial'
+            self._rerun(at, interaction)
+
+
+def sample_memory(stop: threading.Event, start: float, interval: float, memory: list):
+    while not stop.is_set():
+        memory.append((time.monotonic() - start, rss_mb()))
+        stop.wait(interval)
+
+
+def report(args, samples: list, memory: list, sessions: list, elapsed: float) -> dict:
+    import metrics
+
+    by_interaction = defaultdict(list)
+    for _, interaction, latency in samples:
+        by_interaction[interaction].append(latency)
+    latencies = [latency for _, _, latency in samples]
+
+    # Only the st.cache_data stages, the labels of e.g. download and
+    # arrow_cache_read are not hits or misses of a cache lookup.
+    cached_stages = metrics.cached_stages()
+    cache_hits = defaultdict(lambda: {'hit': 0, 'miss': 0})
+    for (stage, result), count in metrics.cache_counts().items():
+        if stage in cached_stages and result in ('hit', 'miss'):
+            cache_hits[stage][result] += count
+
+    return {
+        'config': {
+            'sessions': args.sessions,
+            'duration': args.duration,
+            'think_time': args.think_time,
+            'municipalities': args.municipalities,
+            'indicators': args.indicators,
+            'years': args.years,
+        },
+        'elapsed': elapsed,
+        'reruns': len(samples),
+        'errors': sum(s.errors for s in sessions),
+        'throughput': len(samples) / elapsed,
+        'latency': {
+            name: {
+                'count': len(values),
+                'p50': percentile(values, 50),
+                'p90': percentile(values, 90),
+                'p99': percentile(values, 99),
+                'max': max(values),
+                'mean': statistics.fmean(values),
+            }
+            for name, values in [('all', latencies), *sorted(by_interaction.items())]
+            if values
+        },
+        'cache_hit_rate': {
+            stage: counts['hit'] / (counts['hit'] + counts['miss'])
+            for stage, counts in sorted(cache_hits.items())
+            if counts['hit'] + counts['miss']
+        },
+        'memory_mb': {
+            'start': memory[0][1] if memory else None,
+            'peak': max(m for _, m in memory) if memory else None,
+            'end': memory[-1][1] if memory else None,
+            'timeline': memory,
+        },
+    }
+
+
+def print_report(result: dict):
+    print(
+        f"{result['reruns']} reruns in {result['elapsed']:.1f} s "
+        f"({result['throughput']:.2f} reruns/s, {result['errors']} errors)"
+    )
+    print(f"{'Interaction':<20} {'n':>6} {'p50 ms':>10} {'p90 ms':>10} {'p99 ms':>10}")
+    for name, stats in result['latency'].items():
+        print(
+            f"{name:<20} {stats['count']:>6} {stats['p50'] * 1000:>10.1f} "
+            f"{stats['p90'] * 1000:>10.1f} {stats['p99'] * 1000:>10.1f}"
+        )
+    print('Cache hit rates:')
+    for stage, rate in result['cache_hit_rate'].items():
+        print(f'  {stage:<50} {rate:>6.1%}')
+    memory = result['memory_mb']
+    if memory['timeline']:
+        print(
+            f"RSS: start {memory['start']:.0f} MB, peak {memory['peak']:.0f} MB, "
+            f"end {memory['end']:.0f} MB"
+        )
+        step = max(1, len(memory['timeline']) // 10)
+        for t, m in memory['timeline'][::step]:
+            print(f'  {t:>7.1f} s {m:>8.0f} MB')
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--sessions', type=int, default=24)
+    parser.add_argument('--duration', type=float, default=120, help='Seconds.')
+    parser.add_argument(
+        '--think-time', type=float, default=1.0, help='Mean seconds between interactions.'
+    )
+    parser.add_argument(
+        '--ramp-up', type=float, default=10, help='Seconds over which sessions start.'
+    )
+    parser.add_argument('--timeout', type=float, default=600, help='Per rerun.')
+    parser.add_argument('--sample-interval', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the full report as JSON.')
+    parser.add_argument(
+        '--base-url', help='Use a running ODAPI (stand-in) instead of starting one.'
+    )
+    parser.add_argument('--municipalities', type=int, default=StubConfig.municipalities)
+    parser.add_argument('--indicators', type=int, default=StubConfig.indicators)
+    parser.add_argument('--years', type=int, default=StubConfig.years)
+    args = parser.parse_args()
+
+    server = start_environment(args)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    samples = []
+    memory = []
+    lock = threading.Lock()
+    stop = threading.Event()
+    start = time.monotonic()
+    deadline = start + args.ramp_up + args.duration
+    sampler = threading.Thread(
+        target=sample_memory,
+        args=(stop, start, args.sample_interval, memory),
+        daemon=True,
+    )
+    sampler.start()
+    sessions = [Session(i, args, deadline, samples, lock) for i in range(args.sessions)]
+    try:
+        for session in sessions:
+            session.start()
+        for session in sessions:
+            session.join()
+    finally:
+        stop.set()
+        sampler.join()
+        if server is not None:
+            server.stop()
+
+    result = report(args, samples, memory, sessions, time.monotonic() - start)
+    print_report(result)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+    main()
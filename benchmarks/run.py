@@ -0,0 +1,452 @@
+"""
+Benchmark suite for the dashboard, running against the local ODAPI stand-in
+(see stub_server.py).
+
+    python benchmarks/run.py                      # run all cases, write results JSON
+    python benchmarks/run.py --filter fig_        # run only matching cases
+    python benchmarks/run.py --compare old.json new.json
+
+Results are written to benchmarks/results/<timestamp>_<commit>.json. The
+compare mode prints the change of the median per case and exits with status 1
+if any case regressed by more than --threshold.
+"""
+
+import argparse
+import datetime as dt
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from dataclasses import dataclass
+from importlib import metadata
+from pathlib import Path
+from typing import Callable
+
+from stub_server import StubConfig
+from stub_server import StubServer
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+APPS_DIR = ROOT_DIR / 'apps'
+RESULTS_DIR = Path(__file__).resolve().parent / 'results'
+
+# Same defaults as in app_indikator.py (selectbox index 125 and 72).
+SEL_INDICATOR_ID = 126
+SEL_OTHER_INDICATOR_ID = 73
+
+PACKAGES = ['pandas', 'geopandas', 'pyarrow', 'plotly', 'streamlit', 'shapely']
+
+
+@dataclass
+class Case:
+    name: str
+    func: Callable
+    setup: Callable | None = None
+    repeat: int = 5
+    warmup: int = 1
+
+
+@dataclass
+class CaseResult:
+    name: str
+    runs: int
+    min: float
+    median: float
+    mean: float
+    max: float
+
+
+def measure(case: Case, repeat_factor: float = 1.0) -> CaseResult:
+    repeat = max(1, int(case.repeat * repeat_factor))
+    for _ in range(case.warmup):
+        if case.setup is not None:
+            case.setup()
+        case.func()
+    timings = []
+    for _ in range(repeat):
+        if case.setup is not None:
+            case.setup()
+        start = time.perf_counter()
+        case.func()
+        timings.append(time.perf_counter() - start)
+    return CaseResult(
+        name=case.name,
+        runs=repeat,
+        min=min(timings),
+        median=statistics.median(timings),
+        mean=statistics.fmean(timings),
+        max=max(timings),
+    )
+
+
+def start_environment(args) -> StubServer | None:
+    """
+    Start the stand-in server and point the dashboard to it. Must run before
+    importing any dashboard module, because the base URL is read on import.
+    """
+    server = None
+    if args.base_url:
+        os.environ['ODAPI__BASE_URL'] = args.base_url
+    else:
+        config = StubConfig(
+            municipalities=args.municipalities,
+            indicators=args.indicators,
+            years=args.years,
+        )
+        server = StubServer(config).start()
+        os.environ['ODAPI__BASE_URL'] = server.base_url
+    os.environ.pop('ODAPI__ARROW_CACHE_DIR', None)
+    os.environ.pop('ODAPI__SNAPSHOT_DIR', None)
+    sys.path.insert(0, str(APPS_DIR))
+    return server
+
+
+def build_cases(args) -> list:
+    import pandas as pd
+    import streamlit as st
+    from streamlit.runtime.download_data_util import (
+        convert_data_to_bytes_and_infer_mime,
+    )
+    from streamlit.testing.v1 import AppTest
+
+    import export
+    import load
+    import snapshots
+    import spatial
+    from components import SiteIndicator
+    from components import SitePortrait
+    from peers import PeerIndex
+
+    arrow_cache_dir = tempfile.mkdtemp(prefix='odapi_bench_')
+
+    def clear_caches(arrow_cache: str | None = None):
+        st.cache_data.clear()
+        load.ARROW_CACHE_DIR = arrow_cache
+
+    indicators = load.load_indicators()
+    df = load.load_indicator(SEL_INDICATOR_ID)
+    df_other = load.load_indicator(SEL_OTHER_INDICATOR_ID)
+    periods = sorted(df['period_ref'].unique())
+    first, last = periods[0], periods[-1]
+    df_compare = SiteIndicator.df_other(df[df['period_ref'] == last], df_other, last)
+    df_last = df[df['period_ref'] == last]
+    df_stats, _ = spatial.spatial_stats(df_last)
+
+    cases = [
+        Case(
+            'load_indicator.cold',
+            lambda: load.load_indicator(SEL_INDICATOR_ID),
+            setup=clear_caches,
+        ),
+        Case(
+            'load_indicator.arrow_cache',
+            lambda: load.load_indicator(SEL_INDICATOR_ID),
+            setup=lambda: clear_caches(arrow_cache_dir),
+        ),
+        Case(
+            'load_indicator.st_cache_hit',
+            lambda: load.load_indicator(SEL_INDICATOR_ID),
+            repeat=20,
+        ),
+    ]
+
+    # Arguments per SiteIndicator builder. Every fig_* builder must be listed,
+    # so that new builders are not silently left out of the suite.
+    builder_args = {
+        'fig_map_by_year': (df, last),
+        'fig_hist_by_year': (df, last),
+        'fig_map_all_years': (df,),
+        'fig_hist_all_years': (df,),
+        'fig_boxplot_per_year': (df, first, last),
+        'fig_heatmap_per_year': (df, first, last),
+        'fig_change_over_time': (df, first, last),
+        'fig_compare_with_other_indicator': (
+            df_compare,
+            indicators,
+            SEL_INDICATOR_ID,
+            SEL_OTHER_INDICATOR_ID,
+        ),
+        'fig_neighbour_average_map_by_year': (df, df_stats, last),
+        'fig_lisa_map_by_year': (df, df_stats, last),
+        'df_leader_table_by_year': (df, last),
+        'df_other': (df, df_other, last),
+    }
+    missing = [
+        name
+        for name in dir(SiteIndicator)
+        if name.startswith('fig_') and name not in builder_args
+    ]
+    if missing:
+        raise RuntimeError(f'No benchmark arguments for {", ".join(missing)}.')
+    for name, builder_arg in builder_args.items():
+        builder = getattr(SiteIndicator, name)
+        cases.append(
+            Case(f'SiteIndicator.{name}', lambda b=builder, a=builder_arg: b(*a))
+        )
+
+    cases += [
+        Case(
+            'spatial.adjacency_matrix',
+            lambda: spatial.adjacency_matrix(df_last),
+            setup=spatial._adjacency_matrix.clear,
+        ),
+        Case('spatial.spatial_stats', lambda: spatial.spatial_stats(df_last)),
+    ]
+
+    export_ids = [SEL_INDICATOR_ID, SEL_OTHER_INDICATOR_ID]
+
+    def export_download(layout: str):
+        # Run the result through the conversion of st.download_button for
+        # deferred downloads, which rejects unsupported return types.
+        data = export.export_file(
+            indicators,
+            export_ids,
+            None,
+            first.year,
+            last.year,
+            layout,
+            'parquet',
+            cached_indicator_ids=export_ids,
+        )
+        convert_data_to_bytes_and_infer_mime(
+            data,
+            unsupported_error=RuntimeError(
+                f'Unsupported export type {type(data).__name__}.'
+            ),
+        )
+
+    for layout in ['long', 'wide']:
+        cases.append(
+            Case(f'export.export_file.{layout}', lambda l=layout: export_download(l))
+        )
+
+    snapshot_dir = tempfile.mkdtemp(prefix='odapi_snapshots_')
+    with snapshots.recording(snapshot_dir):
+        snapshots.load_or_build(
+            'fig_map_by_year',
+            SEL_INDICATOR_ID,
+            load.period_fingerprint(df, last),
+            lambda: SiteIndicator.fig_map_by_year(df, last),
+        )
+
+    def read_snapshot():
+        snapshots.SNAPSHOT_DIR = snapshot_dir
+        try:
+            snapshots.load_or_build(
+                'fig_map_by_year',
+                SEL_INDICATOR_ID,
+                load.period_fingerprint(df, last),
+                lambda: SiteIndicator.fig_map_by_year(df, last),
+            )
+        finally:
+            snapshots.SNAPSHOT_DIR = None
+
+    cases.append(Case('snapshots.load_or_build.fig_map_by_year', read_snapshot))
+
+    df_values = load.load_values()
+    peer_year = int(df_values['period_ref'].dt.year.max())
+    peer_index = PeerIndex.build(df_values, peer_year)
+    peer_geo_value = int(peer_index.geo_values[0])
+    data_portrait = pd.read_parquet(
+        load.OdapiWrapper().url_portrait_polg(peer_geo_value, 'parquet')
+    )
+
+    def portrait_loop():
+        # The per-indicator loop of the portrait tab of app_portrait.py, without
+        # the Streamlit elements.
+        for indicator_id in data_portrait['indicator_id'].unique().tolist():
+            _df = data_portrait[data_portrait['indicator_id'] == indicator_id]
+            _df = _df.sort_values('period_ref')
+            _df_hist = SitePortrait.df_hist(df_values, indicator_id)
+            _indicator_unit = _df['indicator_unit'].values[0]
+            SitePortrait.fig_line(_df, _df['indicator_name'].values[0], _indicator_unit)
+            SitePortrait.fig_hist(
+                _df_hist,
+                _df['indicator_value_numeric'].values[-1],
+                _indicator_unit,
+                str(peer_geo_value),
+            )
+
+    cases += [
+        Case('app_portrait.portrait_loop', portrait_loop),
+        Case('PeerIndex.build', lambda: PeerIndex.build(df_values, peer_year)),
+        Case(
+            'PeerIndex.peers',
+            lambda: peer_index.peers(peer_geo_value, 10),
+            repeat=50,
+        ),
+    ]
+
+    def app_case(app: str, interaction: Callable | None = None) -> list:
+        state = {}
+
+        def run_cold():
+            state['at'] = AppTest.from_file(str(APPS_DIR / app), default_timeout=600)
+            state['at'].run()
+            _raise_app_exception(state['at'])
+
+        def run_warm():
+            state['at'].run()
+            _raise_app_exception(state['at'])
+
+        _cases = [
+            Case(f'{app}.cold', run_cold, setup=clear_caches, repeat=3),
+            Case(f'{app}.warm', run_warm, repeat=5),
+        ]
+        if interaction is not None:
+
+            def run_interaction():
+                interaction(state['at']).run()
+                _raise_app_exception(state['at'])
+
+            _cases.append(Case(f'{app}.interaction', run_interaction, repeat=5))
+        return _cases
+
+    def switch_year(at):
+        slider = at.select_slider[0]
+        options = slider.options
+        current = options.index(str(slider.value)) if str(slider.value) in options else 0
+        return slider.set_value(options[(current + 1) % len(options)])
+
+    def switch_municipality(at):
+        selectbox = at.selectbox[0]
+        options = selectbox.options
+        current = selectbox.index or 0
+        return selectbox.select_index((current + 1) % len(options))
+
+    cases += app_case('app_indikator.py', switch_year)
+    cases += app_case('app_portrait.py', switch_municipality)
+    return cases
+
+
+def _raise_app_exception(at):
+    if at.exception:
+        raise RuntimeError(at.exception[0].message)
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def _versions() -> dict:
+    versions = {}
+    for package in PACKAGES:
+        try:
+            versions[package] = metadata.version(package)
+        except metadata.PackageNotFoundError:
+            versions[package] = None
+    return versions
+
+
+def run(args):
+    server = start_environment(args)
+    logging.getLogger('streamlit').setLevel(logging.ERROR)
+    results = []
+    try:
+        for case in build_cases(args):
+            if args.filter and args.filter not in case.name:
+                continue
+            result = measure(case, args.repeat_factor)
+            results.append(result)
+            print(
+                f'{result.name:<50} median {result.median * 1000:>10.1f} ms '
+                f'(min {result.min * 1000:.1f}, n={result.runs})'
+            )
+    finally:
+        if server is not None:
+            server.stop()
+
+    commit = _git_commit()
+    output = args.output or RESULTS_DIR / (
+        f'{dt.datetime.now():%Y%m%dT%H%M%S}_{commit}.json'
+    )
+    output = Path(output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    payload = {
+        'meta': {
+            'timestamp': dt.datetime.now().isoformat(timespec='seconds'),
+            'commit': commit,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'packages': _versions(),
+            'stub': {
+                'base_url': args.base_url,
+                'municipalities': args.municipalities,
+                'indicators': args.indicators,
+                'years': args.years,
+            },
+        },
+        'results': {r.name: asdict(r) for r in results},
+    }
+    output.write_text(json.dumps(payload, indent=2))
+    print(f'Results written to {output}')
+
+
+def compare(base_path: str, new_path: str, threshold: float) -> int:
+    base = json.loads(Path(base_path).read_text())
+    new = json.loads(Path(new_path).read_text())
+    print(
+        f"Base {base['meta']['commit']} ({base['meta']['timestamp']}) -> "
+        f"new {new['meta']['commit']} ({new['meta']['timestamp']})"
+    )
+    regressions = 0
+    for name, result in new['results'].items():
+        if name not in base['results']:
+            print(f'{name:<50} {"new":>10}')
+            continue
+        ratio = result['median'] / base['results'][name]['median']
+        flag = ''
+        if ratio > threshold:
+            flag = 'REGRESSION'
+            regressions += 1
+        elif ratio < 1 / threshold:
+            flag = 'faster'
+        print(
+            f"{name:<50} {base['results'][name]['median'] * 1000:>10.1f} ms "
+            f"-> {result['median'] * 1000:>10.1f} ms  x{ratio:.2f} {flag}"
+        )
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'NEW'))
+    parser.add_argument('--threshold', type=float, default=1.2)
+    parser.add_argument('--filter', help='Only run cases containing this string.')
+    parser.add_argument('--output', help='Path of the results JSON file.')
+    parser.add_argument(
+        '--base-url', help='Use a running ODAPI (stand-in) instead of starting one.'
+    )
+    parser.add_argument('--municipalities', type=int, default=StubConfig.municipalities)
+    parser.add_argument('--indicators', type=int, default=StubConfig.indicators)
+    parser.add_argument('--years', type=int, default=StubConfig.years)
+    parser.add_argument(
+        '--repeat-factor',
+        type=float,
+        default=1.0,
+        help='Scale the number of repetitions per case.',
+    )
+    args = parser.parse_args()
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    run(args)
+
+
+if __name__ == '__main__':
+    main()
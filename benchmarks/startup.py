@@ -0,0 +1,165 @@
+"""
+Import-time and startup profile of both apps against the local ODAPI stand-in
+(see stub_server.py).
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --app app_portrait.py --repeat 5
+
+Every measurement runs in a fresh Python process with streamlit already
+imported (like a running Streamlit server), so that the import cost of the
+dashboard modules is included. Reported per app:
+
+* first paint: time until the first element after set_page_config is sent
+* complete: time until the script run finished
+
+Additionally, the slowest imports of the dashboard modules (python -X importtime)
+are listed.
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from run import APPS_DIR
+from run import start_environment
+from stub_server import StubConfig
+
+MODULES = [
+    'load',
+    'components',
+    'derived',
+    'export',
+    'metrics',
+    'peers',
+    'snapshots',
+    'spatial',
+    'utils',
+]
+
+# Runs inside the child process. Records the time of every element sent to the
+# frontend by patching the message queue of the app session.
+_DRIVER = '''
+import json, sys, time
+import streamlit
+from streamlit.testing.v1 import AppTest
+from streamlit.runtime.forward_msg_queue import ForwardMsgQueue
+
+events = []
+_enqueue = ForwardMsgQueue.enqueue
+
+def enqueue(self, msg):
+    if msg.HasField('delta'):
+        events.append(time.perf_counter())
+    return _enqueue(self, msg)
+
+ForwardMsgQueue.enqueue = enqueue
+app = sys.argv[1]
+start = time.perf_counter()
+at = AppTest.from_file(app, default_timeout=600)
+at.run()
+end = time.perf_counter()
+print(json.dumps({
+    'events': [e - start for e in events],
+    'complete': end - start,
+    'exception': [e.message for e in at.exception],
+}))
+'''
+
+
+def profile_app(app: str) -> dict:
+    result = subprocess.run(
+        [sys.executable, '-c', _DRIVER, str(APPS_DIR / app)],
+        cwd=APPS_DIR,
+        capture_output=True,
+        text=True,
+        env=os.environ.copy(),
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr)
+    measurement = json.loads(result.stdout.strip().splitlines()[-1])
+    if measurement['exception']:
+        raise RuntimeError(measurement['exception'][0])
+    events = measurement['events']
+    return {
+        'first_paint': events[0] if events else measurement['complete'],
+        'complete': measurement['complete'],
+    }
+
+
+def import_profile(top: int) -> list:
+    """
+    Get the slowest imports (cumulative) of the dashboard modules and their
+    direct dependencies, not counting what streamlit already imports.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            '-X',
+            'importtime',
+            '-c',
+            f'import streamlit; import {", ".join(MODULES)}',
+        ],
+        cwd=APPS_DIR,
+        capture_output=True,
+        text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        _, cumulative_us, name = line.split('|')
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), depth, int(cumulative_us)))
+    # importtime lists children before their parent, so everything after the
+    # streamlit entry was imported by the dashboard modules.
+    streamlit_idx = next(
+        i for i, row in enumerate(rows) if row[0] == 'streamlit' and row[1] == 0
+    )
+    rows = [r for r in rows[streamlit_idx + 1 :] if r[1] <= 1]
+    return sorted(rows, key=lambda r: r[2], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--app', action='append', help='Default: app_indikator.py and app_portrait.py'
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--top', type=int, default=15)
+    parser.add_argument(
+        '--base-url', help='Use a running ODAPI (stand-in) instead of starting one.'
+    )
+    parser.add_argument('--municipalities', type=int, default=StubConfig.municipalities)
+    parser.add_argument('--indicators', type=int, default=StubConfig.indicators)
+    parser.add_argument('--years', type=int, default=StubConfig.years)
+    args = parser.parse_args()
+
+    print(f'Slowest imports of {", ".join(MODULES)} (after streamlit):')
+    for name, depth, cumulative_us in import_profile(args.top):
+        print(f'  {cumulative_us / 1000:>8.1f} ms  {"  " * depth}{name}')
+
+    server = start_environment(args)
+    try:
+        for app in args.app or ['app_indikator.py', 'app_portrait.py']:
+            # The first run warms up the stand-in server, it is not counted.
+            profile_app(app)
+            runs = [profile_app(app) for _ in range(args.repeat)]
+            print(f'{app}:')
+            for key in ['first_paint', 'complete']:
+                values = [r[key] for r in runs]
+                print(
+                    f'  {key:<12} median {statistics.median(values) * 1000:>9.1f} ms '
+                    f'(min {min(values) * 1000:.1f})'
+                )
+    finally:
+        if server is not None:
+            server.stop()
+
+
+if __name__ == '__main__':
+    main()
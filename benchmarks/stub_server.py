@@ -0,0 +1,319 @@
+"""
+Local stand-in for the ODAPI, serving synthetic data in the same shape as the
+endpoints used by the dashboard. Run standalone with
+
+    python benchmarks/stub_server.py --port 8765 --municipalities 2100
+
+and point the dashboard to it with ODAPI__BASE_URL=http://localhost:8765.
+"""
+
+import argparse
+import functools
+import hashlib
+import http.server
+import io
+import json
+import re
+import threading
+import urllib.parse
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shapely
+
+# Bounding box of Switzerland (WGS84), used to place the synthetic municipalities.
+BBOX = (5.96, 45.82, 10.49, 47.81)
+
+
+@dataclass(frozen=True)
+class StubConfig:
+    municipalities: int = 2100
+    indicators: int = 200
+    years: int = 10
+    first_year: int = 2014
+    vertices: int = 40  # Approximate vertices per polygon border
+    seed: int = 42
+
+
+class StubData:
+    """
+    Deterministic synthetic ODAPI data. Municipalities are Voronoi cells over the
+    Swiss bounding box (so neighbours share borders), indicator values are a
+    spatially smooth field plus noise, drifting slowly over the years.
+    """
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        rng = np.random.default_rng(config.seed)
+        n = config.municipalities
+        x = rng.uniform(BBOX[0], BBOX[2], n)
+        y = rng.uniform(BBOX[1], BBOX[3], n)
+        points = shapely.points(x, y)
+        cells = shapely.voronoi_polygons(
+            shapely.multipoints(points), extend_to=shapely.box(*BBOX)
+        )
+        cells = shapely.intersection(
+            np.asarray(shapely.get_parts(cells)), shapely.box(*BBOX)
+        )
+        # voronoi_polygons does not keep the input order, match cells to points.
+        tree = shapely.STRtree(cells)
+        order = tree.query(points, predicate='within')
+        geometries = np.empty(n, dtype=object)
+        geometries[order[0]] = cells[order[1]]
+        perimeter = shapely.length(geometries)
+        geometries = np.array(
+            [
+                shapely.segmentize(g, max(p / config.vertices, 1e-4))
+                for g, p in zip(geometries, perimeter)
+            ],
+            dtype=object,
+        )
+        self.x = x
+        self.y = y
+        self.geo_value = np.arange(1, n + 1)
+        self.geo_name = np.array([f'Gemeinde {i}' for i in self.geo_value])
+        self.bezirk_name = np.array([f'Bezirk {i % 150}' for i in self.geo_value])
+        self.kanton_name = np.array([f'Kanton {i % 26}' for i in self.geo_value])
+        self.wkb = shapely.to_wkb(geometries)
+        self.wkb_point = shapely.to_wkb(points)
+        self.periods = [
+            pd.Timestamp(year=config.first_year + i, month=1, day=1)
+            for i in range(config.years)
+        ]
+
+    @functools.cached_property
+    def indicators(self) -> list:
+        return [
+            {
+                'indicator_id': i,
+                'indicator_name': f'Indikator {i}',
+                'indicator_unit': ['Anzahl', 'Prozent', 'CHF'][i % 3],
+                'indicator_description': f'Synthetischer Indikator {i}.',
+                'topic_1': f'Thema {i % 7}',
+                'topic_2': f'Unterthema {i % 19}',
+                'topic_3': None if i % 2 else f'Gruppe {i % 5}',
+                'topic_4': None,
+            }
+            for i in range(1, self.config.indicators + 1)
+        ]
+
+    def indicator(self, indicator_id: int) -> dict:
+        return self.indicators[indicator_id - 1]
+
+    def values(self, indicator_id: int, year_idx: int) -> np.ndarray:
+        rng = np.random.default_rng((self.config.seed, indicator_id, year_idx))
+        phase = indicator_id * 0.7
+        field = np.sin(self.x * 1.3 + phase) + np.cos(self.y * 2.1 - phase)
+        drift = 1 + 0.02 * year_idx
+        scale = 10 ** (indicator_id % 4)
+        offset = -0.5 * scale if indicator_id % 5 == 0 else 2 * scale
+        return (offset + scale * field + rng.normal(0, 0.3 * scale, len(self.x))) * drift
+
+    def _indicator_columns(self, indicator_id: int, n: int) -> dict:
+        _indicator = self.indicator(indicator_id)
+        return {
+            'indicator_id': np.full(n, indicator_id),
+            'indicator_name': np.full(n, _indicator['indicator_name']),
+            'indicator_unit': np.full(n, _indicator['indicator_unit']),
+            'indicator_description': np.full(n, _indicator['indicator_description']),
+            'source': np.full(n, 'Synthetische Quelle'),
+        }
+
+    def df_indicator(self, indicator_id: int, point: bool = False) -> pd.DataFrame:
+        n = len(self.geo_value)
+        frames = []
+        for year_idx, period in enumerate(self.periods):
+            frames.append(
+                pd.DataFrame(
+                    {
+                        'geo_value': self.geo_value,
+                        'geo_name': self.geo_name,
+                        'bezirk_name': self.bezirk_name,
+                        'kanton_name': self.kanton_name,
+                        'period_ref': np.full(n, period),
+                        'indicator_value_numeric': self.values(indicator_id, year_idx),
+                        **self._indicator_columns(indicator_id, n),
+                        'geometry': self.wkb_point if point else self.wkb,
+                    }
+                )
+            )
+        return pd.concat(frames, ignore_index=True)
+
+    def df_portrait(self, geo_value: int) -> pd.DataFrame:
+        idx = int(np.searchsorted(self.geo_value, geo_value))
+        rows = []
+        for _indicator in self.indicators:
+            for year_idx, period in enumerate(self.periods):
+                rows.append(
+                    {
+                        'geo_value': geo_value,
+                        'period_ref': period,
+                        'indicator_value_numeric': self.values(
+                            _indicator['indicator_id'], year_idx
+                        )[idx],
+                        **{
+                            k: v[0]
+                            for k, v in self._indicator_columns(
+                                _indicator['indicator_id'], 1
+                            ).items()
+                        },
+                    }
+                )
+        return pd.DataFrame(rows)
+
+    def df_values(self) -> pd.DataFrame:
+        n = len(self.geo_value)
+        year_idx = len(self.periods) - 1
+        return pd.concat(
+            [
+                pd.DataFrame(
+                    {
+                        'geo_value': self.geo_value,
+                        'period_ref': np.full(n, self.periods[year_idx]),
+                        'indicator_id': np.full(n, _indicator['indicator_id']),
+                        'indicator_value_numeric': self.values(
+                            _indicator['indicator_id'], year_idx
+                        ),
+                    }
+                )
+                for _indicator in self.indicators
+            ],
+            ignore_index=True,
+        )
+
+    def df_municipalities(self) -> pd.DataFrame:
+        return pd.DataFrame(
+            {
+                'gemeinde_bfs_id': self.geo_value,
+                'gemeinde_name': self.geo_name,
+                'bezirk_name': self.bezirk_name,
+                'kanton_name': self.kanton_name,
+            }
+        )
+
+
+def _to_parquet(df: pd.DataFrame) -> bytes:
+    buffer = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    return buffer.getvalue()
+
+
+class StubServer:
+    """
+    Threaded HTTP server for the StubData. Responses carry an ETag and answer
+    conditional requests with 304, like a caching reverse proxy in front of ODAPI.
+    """
+
+    ROUTES = [
+        (re.compile(r'^/indicators/polg$'), 'indicators'),
+        (re.compile(r'^/indicator/polg/(\d+)/parquet$'), 'indicator'),
+        (re.compile(r'^/municipalities/(\d+)/parquet$'), 'municipalities'),
+        (re.compile(r'^/portrait/polg/(\d+)/parquet$'), 'portrait'),
+        (re.compile(r'^/values/polg/parquet$'), 'values'),
+    ]
+
+    def __init__(self, config: StubConfig = StubConfig(), port: int = 0):
+        self.data = StubData(config)
+        self.requests = {}
+        self._lock = threading.Lock()
+        self._bodies = {}
+        handler = functools.partial(_StubHandler, self)
+        self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', port), handler)
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f'http://127.0.0.1:{self.httpd.server_port}'
+
+    def start(self) -> 'StubServer':
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def body(self, route: str, arg: str | None, point: bool = False) -> bytes:
+        key = (route, arg, point)
+        with self._lock:
+            if key in self._bodies:
+                return self._bodies[key]
+        match route:
+            case 'indicators':
+                body = json.dumps(self.data.indicators).encode()
+            case 'indicator':
+                body = _to_parquet(self.data.df_indicator(int(arg), point))
+            case 'municipalities':
+                body = _to_parquet(self.data.df_municipalities())
+            case 'portrait':
+                body = _to_parquet(self.data.df_portrait(int(arg)))
+            case 'values':
+                body = _to_parquet(self.data.df_values())
+        with self._lock:
+            self._bodies[key] = body
+        return body
+
+
+class _StubHandler(http.server.BaseHTTPRequestHandler):
+
+    def __init__(self, server: StubServer, *args, **kwargs):
+        self.stub = server
+        super().__init__(*args, **kwargs)
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        for pattern, route in StubServer.ROUTES:
+            match = pattern.match(path)
+            if match:
+                break
+        else:
+            self.send_error(404)
+            return
+        body = self.stub.body(
+            route,
+            match.group(1) if match.groups() else None,
+            point=urllib.parse.parse_qs(query).get('geometry_mode') == ['point'],
+        )
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self.stub._lock:
+            self.stub.requests[route] = self.stub.requests.get(route, 0) + 1
+        if self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--municipalities', type=int, default=StubConfig.municipalities)
+    parser.add_argument('--indicators', type=int, default=StubConfig.indicators)
+    parser.add_argument('--years', type=int, default=StubConfig.years)
+    parser.add_argument('--vertices', type=int, default=StubConfig.vertices)
+    args = parser.parse_args()
+    config = StubConfig(
+        municipalities=args.municipalities,
+        indicators=args.indicators,
+        years=args.years,
+        vertices=args.vertices,
+    )
+    server = StubServer(config, port=args.port)
+    print(f'Serving synthetic ODAPI on {server.base_url}')
+    server.httpd.serve_forever()
+
+
+if __name__ == '__main__':
+    main()